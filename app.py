@@ -12,28 +12,59 @@ Key Data Structures:
     - DATABASE_TABLES: list of all the database tables that exists in the in-memory db after the database.sql file is run
     - LESSONS_LIST: list of lesson-ids that were successfully validated during the initialisation process
     - TASKS_LIST: list of task-ids that are contained in the validated lessons
-    - COMPLETED_LESSONS: set of all lesson-ids that have been completed (all tasks for that lesson were correctly answered)
-    - COMPLETED_TASKS: set of all task-ids that have been completed 
+    - PROGRESS_STORE: each user's progress and timer (a SessionState per session cookie), i.e. the completed lessons (all tasks for 
+      that lesson were correctly answered), the completed task-ids, the clock start time and previous completion times.
+      Cached in memory, and saved in the background to a pluggable backend (in-process memory, an SQLite file or a network 
+      key-value store), so several instances of the app can share progress
+
+    - DB_VERSION: counter incremented every time the database is (re)loaded by run_init_sql, used to version cached query results
+    - EXPECTED_RESULTS: cache of the expected results (verify-query rows, post-DML rows or created table schema) for each task
+    - SANDBOX_POOL: pre-built sandbox databases for evaluating DML and CREATE TABLE submissions, refilled in the background
+    - READONLY_POOL: pool of read-only connections to the shared in-memory DB, used for all SELECT queries
+    - COLUMN_TYPE_PROBE: connection finding the declared types of a query's result columns without running it (see check_query)
+    - EVAL_POOL: optional worker processes (each with its own copy of the DB) that grade submissions on every core
+    - LESSON_CATALOG: in-memory copy of the validated lesson.json files, their tasks (indexed by task-id) and the lessons-overview.json metadata
 
 Initial Lessons Validation 
     - Potenital lessons are listed in the lessons-overview.json file 
     - For each lesson-id in the lessons-overview file:
         - Check that all required fields (as outlined in the \lessons\template-lesson\lesson.json) exist in the \lessons\{lesson-id}\lesson.json file
         - If validated, add the lesson-id to the LESSONS_LIST, and the task-ids to the TASKS_LIST
+    - The parsed lessons are kept in the LESSON_CATALOG. If any of the lesson files are edited while the app is running, 
+      the lessons are re-validated, and only the files whose modification time changed are re-read from disk
 """
 
 import json
-import re
 import webbrowser
 import sqlite3
 import requests
-import tempfile
-import os
 import sys
+import argparse
+import atexit
+import collections
 import concurrent.futures
+import multiprocessing
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+import secrets
 from pathlib import Path
-from datetime import datetime
-from flask import Flask, request, jsonify, abort, send_from_directory
+from urllib.parse import quote
+from datetime import datetime, timedelta
+from flask import Flask, Response, request, jsonify, abort, send_from_directory, g
+from sql_lexer import lex
+
+try:
+    from waitress import serve as waitress_serve  # optional, only needed for --serve
+except ImportError:
+    waitress_serve = None
+
+try:
+    import resource  # not available on Windows, where evaluation workers are only recycled after a number of evaluations
+except ImportError:
+    resource = None
 
 app = Flask(__name__, static_folder="static", static_url_path="/static")
 APP_URL = "http://127.0.0.1:8000/"
@@ -41,32 +72,1624 @@ APP_URL = "http://127.0.0.1:8000/"
 LESSON_ROOT = Path(__file__).resolve().parent / "lessons"
 INIT_SQL_PATH = Path(__file__).resolve().parent/ "lessons"/ "database.sql"
 _db_initialized = False
+DB_VERSION = 0
+SEED_IMAGE = None  # (DB_VERSION, serialized main DB) used to create sandboxes
+SEED_IMAGE_LOCK = threading.Lock()
 
 # -------------------------------------
 # Session variables
 # -------------------------------------
-COMPLETED_LESSONS = set()
-COMPLETED_TASKS = set()
+class SessionState:
+    """
+    One user's progress (completed lessons and tasks) and timer (clock start time, previous completion times).
+    Requests are served on several threads, so every read and update goes through the lock, and checks followed by 
+    updates (e.g. completing a lesson once all its tasks are complete) are made atomically. Readers get copies.
+    on_change(state) is called after every update (outside the lock), so the owning ProgressStore can persist it.
+    version counts the updates, so a reload from a shared backend never overwrites an update made meanwhile (see load_dict).
+    cleared_at is the (wall clock) time progress was last cleared, which decides how states saved by several instances 
+    are merged (see merge_dicts).
+    """
+
+    def __init__(self, on_change=None):
+        self._lock = threading.Lock()
+        self._on_change = on_change
+        self.version = 0
+        self._completed_lessons = set()
+        self._completed_tasks = set()
+        self._clock_start_time = None
+        self._completion_times = []
+        self._cleared_at = 0.0
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def to_dict(self):
+        """
+        Returns the state as a JSON serializable dict (see from_dict).
+        """
+        with self._lock:
+            return {
+                "completed-lessons": sorted(self._completed_lessons),
+                "completed-tasks": sorted(self._completed_tasks),
+                "clock-start-time": self._clock_start_time.isoformat() if self._clock_start_time else None,
+                "completion-times": [td.total_seconds() for td in self._completion_times],
+                "cleared-at": self._cleared_at
+            }
+
+    def snapshot(self):
+        """
+        Returns (version, to_dict()) read atomically, so a saved copy can later be matched to the state it was taken from.
+        """
+        with self._lock:
+            version = self.version
+        data = self.to_dict()
+        with self._lock:
+            if self.version == version:
+                return version, data
+        return self.snapshot()
+
+    @staticmethod
+    def merge_dicts(saved, local: dict) -> dict:
+        """
+        Merges the saved copy of a session (from to_dict, or None) with this instance's copy before it is written, so 
+        updates made on other instances since the session was loaded are kept:
+            - if one copy was cleared later (reset, or the timer started, cancelled or submitted), that copy is kept
+            - otherwise the completed lessons and tasks are combined, with the earliest clock start and the longer list 
+              of completion times
+        """
+        if saved is None:
+            return local
+        saved_cleared, local_cleared = saved.get("cleared-at") or 0.0, local.get("cleared-at") or 0.0
+        if saved_cleared != local_cleared:
+            return saved if saved_cleared > local_cleared else local
+
+        start_times = [start for start in (saved.get("clock-start-time"), local.get("clock-start-time")) if start]
+        return {
+            "completed-lessons": sorted(set(saved.get("completed-lessons", [])) | set(local.get("completed-lessons", []))),
+            "completed-tasks": sorted(set(saved.get("completed-tasks", [])) | set(local.get("completed-tasks", []))),
+            "clock-start-time": min(start_times, key=datetime.fromisoformat) if start_times else None,
+            "completion-times": max(saved.get("completion-times", []), local.get("completion-times", []), key=len),
+            "cleared-at": local_cleared
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, on_change=None):
+        state = cls(on_change)
+        state.load_dict(data)
+        return state
+
+    def load_dict(self, data: dict, version=None) -> bool:
+        """
+        Replaces the state with a dict from to_dict. If a version is given, the state is only replaced if it was not updated 
+        since that version was read. Returns True if the state was replaced.
+        """
+        start_time = data.get("clock-start-time")
+        with self._lock:
+            if version is not None and version != self.version:
+                return False
+            self._completed_lessons = set(data.get("completed-lessons", []))
+            self._completed_tasks = set(data.get("completed-tasks", []))
+            self._clock_start_time = datetime.fromisoformat(start_time) if start_time else None
+            self._completion_times = [timedelta(seconds=seconds) for seconds in data.get("completion-times", [])]
+            self._cleared_at = data.get("cleared-at") or 0.0
+            return True
+
+    def is_empty(self) -> bool:
+        """
+        Returns True if the state holds no progress or timer state (e.g. a visitor that never completed a task).
+        """
+        with self._lock:
+            return not (self._completed_lessons or self._completed_tasks or self._clock_start_time or self._completion_times)
+
+    def completed(self):
+        """
+        Returns (completed lesson-ids, completed task-ids) as frozensets.
+        """
+        with self._lock:
+            return frozenset(self._completed_lessons), frozenset(self._completed_tasks)
+
+    def complete_task(self, task_id):
+        with self._lock:
+            if task_id in self._completed_tasks:
+                return
+            self._completed_tasks.add(task_id)
+            self.version += 1
+        self._changed()
+
+    def complete_lesson(self, lesson_id: str, task_ids) -> bool:
+        """
+        Marks a lesson as completed if all of its task_ids are completed. Returns True if it was.
+        """
+        with self._lock:
+            if not all(task_id in self._completed_tasks for task_id in task_ids):
+                return False
+            self._completed_lessons.add(lesson_id)
+            self.version += 1
+        self._changed()
+        return True
+
+    def clock_start_time(self):
+        with self._lock:
+            return self._clock_start_time
+
+    def completion_times(self):
+        """
+        Returns the previous completion times (timedeltas), fastest first.
+        """
+        with self._lock:
+            return sorted(self._completion_times)
+
+    def reset(self):
+        """
+        Clears all progress and timer state.
+        """
+        with self._lock:
+            self._completed_lessons.clear()
+            self._completed_tasks.clear()
+            self._clock_start_time = None
+            self._completion_times = []
+            self._cleared_at = time.time()
+            self.version += 1
+        self._changed()
+
+    def start_timer(self):
+        """
+        Clears the completed lessons and tasks, and (re)starts the clock. Returns the start time.
+        """
+        with self._lock:
+            self._clock_start_time = datetime.now()
+            self._completed_lessons.clear()
+            self._completed_tasks.clear()
+            start_time = self._clock_start_time
+            self._cleared_at = time.time()
+            self.version += 1
+        self._changed()
+        return start_time
+
+    def cancel_timer(self):
+        with self._lock:
+            self._clock_start_time = None
+            self._cleared_at = time.time()
+            self.version += 1
+        self._changed()
+
+    def submit_time(self, lesson_ids):
+        """
+        If the completed lessons are exactly lesson_ids, records the time since the clock started (if it was running),
+        clears the completed lessons and stops the clock.
+        Returns (submitted, outstanding lesson-ids).
+        """
+        with self._lock:
+            if set(lesson_ids) != self._completed_lessons:
+                return False, [lesson_id for lesson_id in lesson_ids if lesson_id not in self._completed_lessons]
+            if self._clock_start_time:
+                self._completion_times.append(datetime.now() - self._clock_start_time)
+            self._completed_lessons.clear()
+            self._clock_start_time = None
+            self._cleared_at = time.time()
+            self.version += 1
+        self._changed()
+        return True, []
 
 DATABASE_TABLES = []
 LESSON_LIST = []
 TASKS_LIST = []
 
-CLOCK_START_TIME = None
-PREVIOUS_COMPLETION_TIMES = []
-
 # -------------------------------------
 # Config / constants
 # -------------------------------------
 PREVIEW_ROW_LIMIT = 200
-EVAL_ROW_LIMIT = 500
+EVAL_ROW_LIMIT = 500  # expected results with more rows are not held in Python, they are graded inside SQLite
+DIFF_ROW_LIMIT = 10  # missing / extra rows listed in the diff report of a wrong answer
+STREAM_BATCH_SIZE = 100  # rows fetched and serialized at a time by streamed query results
 QUERY_TIMEOUT = 10 
+QUERY_INSTRUCTION_BUDGET = 50_000_000  # SQLite VM instructions a single query may run before it is interrupted
+PROGRESS_HANDLER_INTERVAL = 1000  # VM instructions between checks of a running query's limits
+QUERY_WORKERS = 8  # threads in the long-lived QUERY_EXECUTOR (--workers)
+SERVER_THREADS = 16  # request threads of the production WSGI server (--threads)
+PRIORITY_EVALUATE, PRIORITY_PREVIEW, PRIORITY_TABLE = 0, 1, 2  # QUERY_SCHEDULER priorities, lowest runs first
+SCHEDULER_CLIENT_SLOTS = 2  # requests a single client (session) may run at once
+SCHEDULER_SHED_DEPTH = 32  # waiting requests at which new previews and table reads are shed with a 429
+PREVIEW_TRACKER_EDITORS = 4096  # editors whose latest preview is tracked for supersession
+LIVE_PING_INTERVAL = 15  # seconds between keep-alive comments on an idle live-preview channel
+LIVE_IDLE_TIMEOUT = 30  # seconds without updates after which a live-preview channel is closed (it holds a request thread)
+LIVE_CHANNEL_LIMIT = 8  # live-preview channels open at once (--live-channels), each holds a request thread
+SCHEDULER_MAX_WAIT = {PRIORITY_EVALUATE: 60, PRIORITY_PREVIEW: 2, PRIORITY_TABLE: 5}  # seconds a request may wait for a slot
+EVAL_PROCESSES = 0  # evaluation worker processes (--eval-processes), 0 grades submissions in the request threads
+EVAL_MAX_TASKS_PER_WORKER = 500  # evaluations before a worker process is replaced
+EVAL_WORKER_MAX_MEMORY = 512 * 1024 * 1024  # bytes, workers are replaced once one reports a higher peak memory
+DEFAULT_QUERY_LIMITS = {"timeout": QUERY_TIMEOUT, "instruction-budget": QUERY_INSTRUCTION_BUDGET}
+LESSON_RELOAD_INTERVAL = 2  # seconds between checks for edited lesson files
+WARM_UP_WORKERS = 4
+READONLY_POOL_SIZE = 8  # maximum number of pooled read-only connections (one per concurrently querying thread)
+POOL_HEALTH_CHECK_INTERVAL = 30  # seconds a connection can sit idle before it is health checked on reuse
+SANDBOX_POOL_SIZE = 8  # number of pre-built sandboxes kept ready for DML and create-tables submissions
+SLOW_TASK_WARNING = 0.5  # seconds, tasks slower than this are highlighted by the warm up
+PREVIEW_CACHE_ENTRIES = 256  # serialized preview responses kept in the PreviewCache...
+PREVIEW_CACHE_BYTES = 16 * 1024 * 1024  # ...up to this many bytes in total
+VERDICT_CACHE_ENTRIES = 4096  # evaluated submissions remembered by the VerdictCache
+PROGRESS_DB_PATH = Path.home() / ".sql-training-app" / "progress.db"  # where the sqlite progress backend saves to (--progress-db)
+PROGRESS_FLUSH_INTERVAL = 1.0  # seconds between write-behind flushes of changed progress
+PROGRESS_CACHE_TTL = 2.0  # seconds a session's progress is cached before it is reloaded from a shared backend
+PROGRESS_SESSION_IDLE = 600  # seconds without requests after which a saved session is dropped from memory (see ProgressStore.evict_idle)
+PROGRESS_KV_TIMEOUT = 5  # seconds, for requests to the kv progress backend
+SESSION_COOKIE_NAME = "sql_training_session"
+SESSION_COOKIE_MAX_AGE = 365 * 24 * 3600  # seconds
+STATEMENT_CACHE_MIN = 128  # compiled statements cached per read-only connection (sqlite3's default)...
+STATEMENT_CACHE_PER_TASK = 4  # ...raised to cover each task's verify-query, column probe and grading queries, plus previews
+
+# What read-only connections may do, checked by the SQLite authorizer when a statement is compiled (see readonly_authorizer)
+READONLY_AUTHORIZER_ACTIONS = frozenset({
+    sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE, sqlite3.SQLITE_TRANSACTION
+})
+READONLY_PRAGMAS = frozenset({"table_info", "table_xinfo", "index_list", "index_info", "foreign_key_list"})
+# Table-valued pragma functions (e.g. pragma_table_info('Countries')) report an update of the schema table while SQLite loads them
+SCHEMA_TABLES = frozenset({"sqlite_master", "sqlite_schema", "sqlite_temp_master", "sqlite_temp_schema"})
+
+# -------------------------------------
+# Lesson catalog
+# -------------------------------------
+class LessonCatalog:
+    """
+    In-memory store of the validated lessons, built by detect_and_validate_lessons().
+        - lessons: lesson-id -> parsed lesson.json
+        - tasks: task-id -> task dict (from the lesson's exercise-tasks)
+        - task_index: (lesson-id, task-id) -> task record, with the task's evaluation flags precomputed (see build_task_record)
+        - overview: lesson-id -> lessons-overview.json entry
+        - summary: prebuilt payload for the /lessons endpoint (without the completed flags)
+    Parsed files are cached against their modification time, so a re-validation only re-reads the files that changed.
+    """
+
+    def __init__(self):
+        self.lessons = {}
+        self.tasks = {}
+        self.task_index = {}
+        self.overview = {}
+        self.summary = {}
+        self._files = {}  # path -> (mtime_ns, parsed contents)
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+
+    def read_json(self, path: Path):
+        """
+        Returns the parsed JSON file at path, only re-reading it if its modification time changed.
+        """
+        mtime = path.stat().st_mtime_ns
+        cached = self._files.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, "r", encoding="utf-8") as f:
+            parsed = json.load(f)
+        self._files[path] = (mtime, parsed)
+        return parsed
+
+    def read_text(self, path: Path):
+        """
+        Returns the text contents of the file at path, only re-reading it if its modification time changed.
+        """
+        mtime = path.stat().st_mtime_ns
+        cached = self._files.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        self._files[path] = (mtime, text)
+        return text
+
+    def publish(self, lessons: dict, overview: dict, lesson_list: list):
+        """
+        Replaces the catalog contents with a newly validated set of lessons, and rebuilds the task index and /lessons payload.
+        """
+        tasks = {}
+        task_index = {}
+        summary = {}
+        for lesson_id in lesson_list:
+            lesson = lessons[lesson_id]
+            for task in lesson.get("exercise-tasks") or []:
+                tasks[task.get("task-id")] = task
+                task_index[(lesson_id, task.get("task-id"))] = build_task_record(lesson_id, task)
+            summary[lesson_id] = {
+                "title": lesson.get("title"),
+                "subtitle": lesson.get("subtitle"),
+                "order": lesson.get("lesson-order"),
+                "difficulty": overview.get(lesson_id, {}).get("difficulty")
+            }
+
+        # Swap in complete structures so concurrent readers never see a half built catalog
+        self.lessons = {lesson_id: lessons[lesson_id] for lesson_id in lesson_list}
+        self.overview = overview
+        self.tasks = tasks
+        self.task_index = task_index
+        self.summary = summary
+
+    def files_changed(self):
+        """
+        Returns True if any of the cached lesson files were modified (or deleted) since they were last read.
+        """
+        for path, (mtime, _) in list(self._files.items()):
+            try:
+                if path.stat().st_mtime_ns != mtime:
+                    return True
+            except FileNotFoundError:
+                del self._files[path]
+                return True
+        return False
+
+    def refresh(self):
+        """
+        Re-validates the lessons if any lesson files changed on disk. Checks are throttled to once every LESSON_RELOAD_INTERVAL seconds.
+        An edited lesson that fails validation keeps its previously loaded version (see detect_and_validate_lessons), 
+        and if the reload raises (e.g. a malformed JSON file, or duplicate ids) all the previously loaded lessons are kept.
+        """
+        now = time.monotonic()
+        if now - self._last_check < LESSON_RELOAD_INTERVAL:
+            return
+        if not self._lock.acquire(blocking=False):
+            # Another request is already checking/reloading
+            return
+        try:
+            self._last_check = now
+            if self.files_changed():
+                try:
+                    detect_and_validate_lessons()
+                    VERDICT_CACHE.clear()
+                except Exception as e:
+                    print("Failed to reload lessons, keeping the previous lessons:", e)
+        finally:
+            self._lock.release()
+
+def build_task_record(lesson_id: str, task: dict):
+    """
+    Builds the task index entry for a task, with the flags used to pick the evaluation method precomputed.
+    """
+    return {
+        "lesson-id": lesson_id,
+        "task": task,
+        "allow-dml": bool(task.get("allow-dml")),
+        "create-tables": bool(task.get("create-tables")),
+        "order-sensitive": bool(task.get("order-sensitive")),
+        "preview-allowed": bool(task.get("preview-allowed")),
+        # Optional per task overrides of the query limits
+        "limits": {
+            "timeout": task.get("query-timeout", QUERY_TIMEOUT),
+            "instruction-budget": task.get("instruction-budget", QUERY_INSTRUCTION_BUDGET)
+        }
+    }
+
+LESSON_CATALOG = LessonCatalog()
+
+# -------------------------------------
+# Result caches
+# -------------------------------------
+class ExpectedResultCache:
+    """
+    Caches the expected outcome of each task, which only depends on the seed data and the task's queries:
+        - "verify": the verify-query rows of read-only tasks
+        - "dml": the verify-query rows after the correct-query was applied in a sandbox (allow-dml tasks)
+        - "schema": the table schema (see get_table_schema) created by the correct-query (create-tables tasks)
+    Rows are stored already in the form used for comparison (see build_expected_rows). The reference data only 
+    changes when run_init_sql reloads the database, so entries are keyed by kind, task-id and DB_VERSION. The query text(s) 
+    the entry was built from are stored with each entry, so an edited lesson.json never serves stale results.
+    """
+
+    def __init__(self):
+        self._entries = {}  # (kind, task-id, DB_VERSION) -> (source queries, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, task_id, source, kind="verify"):
+        """
+        Returns the cached value for a task, or None if there is no entry built from the same source queries.
+        """
+        entry = self._entries.get((kind, task_id, DB_VERSION))
+        with self._lock:
+            if entry is None or entry[0] != source:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry[1]
+
+    def put(self, task_id, source, value, kind="verify"):
+        with self._lock:
+            self._entries[(kind, task_id, DB_VERSION)] = (source, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self) -> dict:
+        """
+        Returns a copy of the entries for the current DB_VERSION, e.g. to hand a warmed up cache to evaluation workers.
+        """
+        with self._lock:
+            return {key: entry for key, entry in self._entries.items() if key[2] == DB_VERSION}
+
+    def load(self, entries: dict):
+        with self._lock:
+            self._entries.update(entries)
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+EXPECTED_RESULTS = ExpectedResultCache()
+
+class PreviewCache:
+    """
+    Bounded LRU cache of serialized preview responses (the JSON streamed by stream_readonly_query), so a query that was 
+    already previewed (e.g. text the user toggled back to, or a task's initial-query) is answered without touching SQLite.
+    Entries are keyed by the exact fingerprint of the query that is run (see sql_lexer, so comments and whitespace don't 
+    matter, but the case of words does, as the cached column headers keep it), the row limit and DB_VERSION.
+    The cache is bounded both by number of entries and total bytes, evicting the least recently used.
+    """
+
+    def __init__(self, max_entries=PREVIEW_CACHE_ENTRIES, max_bytes=PREVIEW_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()  # (fingerprint, row limit, DB_VERSION) -> payload, least recently used first
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(sql: str, row_limit):
+        return (lex(sql).exact_fingerprint, row_limit, DB_VERSION)
+
+    @staticmethod
+    def _size(key, payload: bytes) -> int:
+        return len(key[0]) + len(payload)
+
+    def get(self, key):
+        """
+        Returns the cached payload (bytes) for a key, or None.
+        """
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, key, payload: bytes):
+        """
+        Stores a payload, evicting the least recently used entries to stay within max_entries and max_bytes.
+        Payloads larger than the whole cache are not stored.
+        """
+        size = self._size(key, payload)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old_payload = self._entries.pop(key, None)
+            if old_payload is not None:
+                self.bytes -= self._size(key, old_payload)
+            self._entries[key] = payload
+            self.bytes += size
+
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                old_key, old_payload = self._entries.popitem(last=False)
+                self.bytes -= self._size(old_key, old_payload)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+PREVIEW_CACHE = PreviewCache()
+
+class VerdictCache:
+    """
+    Bounded LRU cache of evaluation verdicts, so identical submissions (e.g. a whole class submitting the same answer) skip
+    sandbox creation and query execution. Entries are keyed by task-id, the submission's exact fingerprint (see sql_lexer, 
+    so comments and whitespace don't matter, but the case of words does, as created table and column names are compared
+    case-sensitively) and DB_VERSION, and hold (results_match, user_error, diff).
+    The cache is cleared whenever the lessons are reloaded, as the task's queries may have changed.
+    """
+
+    def __init__(self, max_entries=VERDICT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()  # (task-id, exact fingerprint, DB_VERSION) -> verdict, least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(task_id, query: str):
+        return (task_id, lex(query).exact_fingerprint, DB_VERSION)
+
+    def get(self, key):
+        with self._lock:
+            verdict = self._entries.get(key)
+            if verdict is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return verdict
+
+    def put(self, key, verdict):
+        with self._lock:
+            self._entries[key] = verdict
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+VERDICT_CACHE = VerdictCache()
+
+# -------------------------------------
+# Session progress
+# -------------------------------------
+class MemoryProgressBackend:
+    """
+    Keeps saved progress in this process only, so it is lost on restart and can't be shared between instances.
+    """
+    name = "memory"
+    shared = False
+
+    def __init__(self):
+        self._states = {}  # session id -> JSON text
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str):
+        with self._lock:
+            state = self._states.get(session_id)
+        return json.loads(state) if state is not None else None
+
+    def load_all(self):
+        with self._lock:
+            return {session_id: json.loads(state) for session_id, state in self._states.items()}
+
+    def save_many(self, states: dict) -> dict:
+        merged = {}
+        with self._lock:
+            for session_id, state in states.items():
+                saved = self._states.get(session_id)
+                merged[session_id] = SessionState.merge_dicts(json.loads(saved) if saved is not None else None, state)
+                self._states[session_id] = json.dumps(merged[session_id])
+        return merged
+
+    def close(self):
+        pass
+
+class SQLiteProgressBackend:
+    """
+    Saves progress to a local SQLite file in WAL mode. Several instances on the same machine can share the file,
+    if they are started with shared=True (--progress-shared). Otherwise this instance is assumed to be the file's only writer,
+    and cached progress is never reloaded from it.
+    """
+    name = "sqlite"
+
+    def __init__(self, path: Path, shared=False):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=QUERY_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)")
+
+    def load(self, session_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_all(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT session_id, state FROM sessions").fetchall()
+        return {session_id: json.loads(state) for session_id, state in rows}
+
+    def save_many(self, states: dict) -> dict:
+        now = time.time()
+        merged = {}
+        with self._lock, self._conn:
+            # The write lock is taken before reading, so instances saving the same session at once merge in turn
+            self._conn.execute("BEGIN IMMEDIATE")
+            for session_id, state in states.items():
+                row = self._conn.execute("SELECT state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+                merged[session_id] = SessionState.merge_dicts(json.loads(row[0]) if row else None, state)
+            rows = [(session_id, json.dumps(state), now) for session_id, state in merged.items()]
+            self._conn.executemany(
+                "INSERT INTO sessions (session_id, state, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET state = excluded.state, updated = excluded.updated",
+                rows
+            )
+        return merged
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class HttpKVClient:
+    """
+    Client for a network key-value store with a plain HTTP interface: GET <url>/<key> returns the value (404 if missing), 
+    and PUT <url>/<key> stores the request body.
+    """
+
+    def __init__(self, url: str, timeout=PROGRESS_KV_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def get(self, key: str):
+        response = self._session.get(f"{self.url}/{quote(key, safe='')}", timeout=self.timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.text
+
+    def put(self, key: str, value: str):
+        response = self._session.put(
+            f"{self.url}/{quote(key, safe='')}", data=value.encode("utf-8"),
+            headers={"Content-Type": "application/json"}, timeout=self.timeout
+        )
+        response.raise_for_status()
+
+class LocalKVClient:
+    """
+    In-process stand-in for HttpKVClient (same get / put interface), e.g. for tests of the key-value backend without a server.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            return self._values.get(key)
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._values[key] = value
+
+class KVProgressBackend:
+    """
+    Saves progress in a network key-value store (through a client such as HttpKVClient), so instances on different machines
+    share progress. A key-value store can't list its keys, so sessions are loaded when they are first used.
+    """
+    name = "kv"
+    shared = True
+
+    def __init__(self, client, prefix="sql-training-progress:"):
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, session_id: str):
+        state = self.client.get(self.prefix + session_id)
+        return json.loads(state) if state is not None else None
+
+    def load_all(self):
+        return {}
+
+    def save_many(self, states: dict) -> dict:
+        # Read, merge and write: a plain key-value store has no transactions, so two instances saving the same session 
+        # at the very same moment can still lose one update
+        merged = {}
+        for session_id, state in states.items():
+            merged[session_id] = SessionState.merge_dicts(self.load(session_id), state)
+            self.client.put(self.prefix + session_id, json.dumps(merged[session_id]))
+        return merged
+
+    def close(self):
+        pass
+
+class ProgressStore:
+    """
+    Holds each user's SessionState, keyed by the session id in their SESSION_COOKIE_NAME cookie, in front of a backend 
+    (MemoryProgressBackend, SQLiteProgressBackend or KVProgressBackend) that the progress is saved to.
+        - States are cached in memory, so most reads never touch the backend. With a shared backend (one that other instances 
+          also write to), a cached state is reloaded once it is older than cache_ttl seconds, unless it has unsaved changes.
+          This keeps the app itself stateless: instances on other ports or machines see each other's progress within about 
+          flush_interval + cache_ttl seconds.
+        - Writes are write-behind: updates only mark the session dirty, and a background thread saves the dirty sessions 
+          in one batch every flush_interval seconds. An evaluation request never waits on a disk or network write.
+          Sessions being saved stay in_flight until the save returns, and are not reloaded meanwhile (the backend 
+          still has their previous state). The backends merge each state with the saved one (see SessionState.merge_dicts), 
+          so instances updating the same session keep each other's progress, and the merged state is kept in memory.
+        - open() loads every saved session the backend can list in one go, so a restart recovers everyone's progress quickly.
+        - Sessions without requests for idle_timeout seconds are dropped from memory once saved (see evict_idle), so 
+          cookie-less clients (crawlers, health checks...) that each get a new session don't grow memory without bound.
+    Until open() is called, progress is kept in memory only.
+    """
+
+    def __init__(self, backend=None, flush_interval=PROGRESS_FLUSH_INTERVAL, cache_ttl=PROGRESS_CACHE_TTL, idle_timeout=PROGRESS_SESSION_IDLE):
+        self.backend = backend or MemoryProgressBackend()
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.idle_timeout = idle_timeout
+        self._sessions = {}  # session id -> [SessionState, time loaded from the backend, time last requested]
+        self._dirty = set()  # session ids changed since the last flush
+        self._in_flight = set()  # session ids being saved by the current flush
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._last_eviction = time.monotonic()
+        self.flushes = 0
+        self.rows_written = 0
+        self.reloads = 0
+        self.evicted = 0
+
+    def open(self, backend):
+        """
+        Switches to the given backend, loads the sessions it has saved and starts the write-behind thread.
+        """
+        self.backend = backend
+        saved = backend.load_all()
+        now = time.monotonic()
+        with self._lock:
+            for session_id, data in saved.items():
+                state = SessionState.from_dict(data, on_change=self._make_on_change(session_id))
+                self._sessions[session_id] = [state, now, now]
+        print(f"Loaded progress for {len(saved)} sessions from the {backend.name} backend")
+
+        self._thread = threading.Thread(target=self._flush_loop, name="progress-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _make_on_change(self, session_id: str):
+        def on_change(state):
+            with self._lock:
+                if session_id not in self._sessions:
+                    # Evicted while a (very long) request still held it
+                    now = time.monotonic()
+                    self._sessions[session_id] = [state, now, now]
+                self._dirty.add(session_id)
+        return on_change
+
+    def get(self, session_id: str) -> SessionState:
+        """
+        Returns the session's state, loading it from the backend if it isn't cached (or the cached copy expired), 
+        and creating an empty one for a new session id.
+        A backend that isn't shared is never read here: open() already loaded every session it has, and only empty 
+        sessions are evicted, so a session missing from the cache has no progress.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry[2] = now
+            if entry is not None and (
+                not self.backend.shared or session_id in self._dirty or session_id in self._in_flight
+                or now - entry[1] < self.cache_ttl
+            ):
+                return entry[0]
+            if entry is None:
+                entry = [SessionState(on_change=self._make_on_change(session_id)), now, now]
+                self._sessions[session_id] = entry
+                if not self.backend.shared:
+                    return entry[0]
+            state = entry[0]
+            version = state.version
+
+        # Load outside the lock, the backend may be on the network
+        try:
+            data = self.backend.load(session_id)
+        except Exception as e:
+            print("Failed to load progress, using the cached copy:", e)
+            return state
+
+        if data is not None and state.load_dict(data, version=version):
+            self.reloads += 1
+        with self._lock:
+            entry[1] = now
+        return state
+
+    def _flush_loop(self):
+        while not self._wake.wait(self.flush_interval):
+            self.flush()
+            if time.monotonic() - self._last_eviction >= self.idle_timeout / 10:
+                self.evict_idle()
+
+    def evict_idle(self):
+        """
+        Drops the sessions that had no requests for idle_timeout seconds and have no unsaved changes, if they can be 
+        recreated exactly on their next request: from a shared backend (which get() reloads from), or because they are 
+        empty (the backend has nothing else for them). Returns the number of sessions dropped.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._last_eviction = now
+            idle = [
+                session_id for session_id, entry in self._sessions.items()
+                if now - entry[2] >= self.idle_timeout and session_id not in self._dirty and session_id not in self._in_flight
+            ]
+            evicted = 0
+            for session_id in idle:
+                if self.backend.shared or self._sessions[session_id][0].is_empty():
+                    del self._sessions[session_id]
+                    evicted += 1
+            self.evicted += evicted
+        return evicted
+
+    def flush(self):
+        """
+        Saves the sessions changed since the last flush in one batch. Failed writes are retried on the next flush.
+        A merged state replaces the cached one unless the session was updated during the save (it is then saved again).
+        """
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                self._in_flight = dirty
+                states = {session_id: self._sessions[session_id][0] for session_id in dirty}
+            if not states:
+                return
+
+            try:
+                snapshots = {session_id: state.snapshot() for session_id, state in states.items()}
+                merged = self.backend.save_many({session_id: data for session_id, (_, data) in snapshots.items()})
+                for session_id, (version, data) in snapshots.items():
+                    if merged[session_id] != data:
+                        states[session_id].load_dict(merged[session_id], version=version)
+                self.flushes += 1
+                self.rows_written += len(states)
+            except Exception as e:
+                print("Failed to save progress, retrying on the next flush:", e)
+                with self._lock:
+                    self._dirty.update(dirty)
+            finally:
+                with self._lock:
+                    self._in_flight = set()
+
+    def close(self):
+        """
+        Stops the write-behind thread, saves any remaining changes and closes the backend.
+        """
+        self._wake.set()
+        self.flush()
+        self.backend.close()
+
+    def stats(self):
+        return {
+            "backend": self.backend.name,
+            "sessions": len(self._sessions),
+            "dirty": len(self._dirty),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "reloads": self.reloads,
+            "evicted": self.evicted
+        }
+
+def build_progress_backend(kind: str, path: Path = PROGRESS_DB_PATH, kv_url=None, shared=False):
+    """
+    Returns the progress backend for the --progress-backend option: "memory", "sqlite" (saved to path, shared with other
+    instances if shared is set) or "kv" (at kv_url, always shared).
+    """
+    if kind == "memory":
+        return MemoryProgressBackend()
+    if kind == "sqlite":
+        return SQLiteProgressBackend(path, shared=shared)
+    if kind == "kv":
+        if not kv_url:
+            raise ValueError("The kv progress backend needs --progress-kv-url")
+        return KVProgressBackend(HttpKVClient(kv_url))
+    raise ValueError(f"Unknown progress backend: {kind}")
+
+PROGRESS_STORE = ProgressStore()
+
+@app.before_request
+def assign_session_id():
+    """
+    Reads the user's session id from their cookie, or assigns a new one (sent back by set_session_cookie).
+    """
+    session_id = request.cookies.get(SESSION_COOKIE_NAME, "")
+    if 0 < len(session_id) <= 64 and session_id.replace("-", "").replace("_", "").isalnum():
+        g.session_id = session_id
+    else:
+        g.session_id = secrets.token_urlsafe(18)
+        g.new_session = True
+
+@app.after_request
+def set_session_cookie(response):
+    if g.get("new_session"):
+        response.set_cookie(SESSION_COOKIE_NAME, g.session_id, max_age=SESSION_COOKIE_MAX_AGE, httponly=True, samesite="Lax")
+    return response
+
+def current_session() -> SessionState:
+    """
+    Returns the SessionState of the user making the request.
+    """
+    return PROGRESS_STORE.get(g.session_id)
+
+# -------------------------------------
+# Database connections
+# -------------------------------------
+def readonly_authorizer(action, arg1, arg2, db_name, trigger_name):
+    """
+    SQLite authorizer for read-only connections: only reads, function calls (including recursive CTEs) and the schema
+    reading pragmas in READONLY_PRAGMAS are allowed. Anything else (writes, DDL, ATTACH, other pragmas...) fails to compile
+    with a "not authorized" error, whatever the query text looks like.
+    Updates of the schema table are let through, as SQLite reports one when it loads a table-valued pragma function
+    (which is then checked as a pragma). Real writes to it are still refused: SQLite never lets queries modify the schema
+    table without the writable_schema pragma, and the connection is query_only.
+    """
+    if action in READONLY_AUTHORIZER_ACTIONS:
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_UPDATE and arg1 in SCHEMA_TABLES:
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_PRAGMA and arg1.lower() in READONLY_PRAGMAS:
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+def statement_cache_size() -> int:
+    """
+    Number of compiled statements each read-only connection caches, sized for the loaded tasks.
+    Repeated statements (e.g. verify-queries, or the same preview twice) skip compilation, and so the authorizer.
+    """
+    return max(STATEMENT_CACHE_MIN, STATEMENT_CACHE_PER_TASK * len(LESSON_CATALOG.task_index))
+
+class ReadOnlyConnectionPool:
+    """
+    Bounded pool of read-only connections to the shared in-memory DB (DB_PATH).
+    Connections are opened lazily with PRAGMA query_only and the readonly_authorizer, and reused across requests instead of connecting per query.
+    Each worker thread holds at most one connection at a time, so the pool size bounds the number of concurrent queries.
+    Idle connections are health checked before reuse, and replaced if the check fails.
+    """
+
+    def __init__(self, max_size=READONLY_POOL_SIZE, health_check_interval=POOL_HEALTH_CHECK_INTERVAL):
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self._idle = []  # [(connection, last used time)], most recently used last
+        self._cond = threading.Condition()
+        self._opened = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.replaced = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(DB_PATH, uri=True, check_same_thread=False, cached_statements=statement_cache_size())
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON")
+        conn.set_authorizer(readonly_authorizer)
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self, timeout=QUERY_TIMEOUT):
+        """
+        Checks out a connection, waiting up to timeout seconds if all connections are in use.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._idle and self._opened >= self.max_size:
+                self.waits += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    raise TimeoutError("No database connections available")
+
+            conn = None
+            if self._idle:
+                conn, last_used = self._idle.pop()
+            else:
+                self._opened += 1
+            self.in_use += 1
+            self.checkouts += 1
+
+        try:
+            if conn is not None and time.monotonic() - last_used > self.health_check_interval and not self._is_healthy(conn):
+                conn.close()
+                conn = None
+                with self._cond:
+                    self.replaced += 1
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self.in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn):
+        """
+        Returns a connection to the pool.
+        """
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = sqlite3.Row
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self.in_use -= 1
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self, timeout=QUERY_TIMEOUT):
+        """
+        Context manager which checks out a connection and always returns it to the pool.
+        """
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                conn.close()
+            self._opened -= len(self._idle)
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "open": self._opened,
+                "in_use": self.in_use,
+                "idle": len(self._idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "replaced": self.replaced
+            }
+
+READONLY_POOL = ReadOnlyConnectionPool()
+
+def probe_authorizer(action, arg1, arg2, db_name, trigger_name):
+    """
+    SQLite authorizer for the COLUMN_TYPE_PROBE connection: read-only (see readonly_authorizer), except for creating and 
+    dropping temporary views, which writes to the connection's private temp schema only.
+    """
+    if action in (sqlite3.SQLITE_CREATE_TEMP_VIEW, sqlite3.SQLITE_DROP_TEMP_VIEW):
+        return sqlite3.SQLITE_OK
+    if action in (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE) and db_name == "temp":
+        return sqlite3.SQLITE_OK
+    return readonly_authorizer(action, arg1, arg2, db_name, trigger_name)
+
+class ColumnTypeProbe:
+    """
+    Connections to the shared in-memory DB (DB_PATH) that find the declared types of a query's result columns without running it:
+    the query is defined as a temporary view, whose PRAGMA table_info lists the column names and declared types.
+    (The read-only pool can't do this, as its connections are query_only.) Temporary views are private to their connection, 
+    so each connection is used by one thread at a time. Idle connections are kept for reuse, and a new one is opened when 
+    they are all in use, so concurrent checks don't wait on each other (their number is bounded by the QUERY_SCHEDULER).
+    """
+    VIEW_NAME = "sql_training_check"
+
+    def __init__(self):
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            self.opened += 1
+        conn = sqlite3.connect(DB_PATH, uri=True, check_same_thread=False)
+        conn.set_authorizer(probe_authorizer)
+        return conn
+
+    def columns(self, sql: str, limits=None) -> list:
+        """
+        Returns the result columns of a validated SELECT query as [{"name": ..., "type": ...}].
+        Expression columns have no declared type (None).
+        """
+        conn = self._checkout()
+        try:
+            with query_limits(conn, limits):
+                conn.execute(f"DROP VIEW IF EXISTS temp.{self.VIEW_NAME}")
+                conn.execute(f"CREATE TEMP VIEW {self.VIEW_NAME} AS\n{subquery_sql(sql)}")
+                try:
+                    rows = conn.execute(f"PRAGMA temp.table_info({self.VIEW_NAME})").fetchall()
+                finally:
+                    conn.execute(f"DROP VIEW temp.{self.VIEW_NAME}")
+        finally:
+            with self._lock:
+                self._idle.append(conn)
+
+        return [{"name": row[1], "type": row[2] or None} for row in rows]
+
+    def stats(self):
+        with self._lock:
+            return {"opened": self.opened, "idle": len(self._idle)}
 
-# Forbidden read-only statements (writes, DDL, admin)
-FORBIDDEN_SQL_RE = re.compile(
-    r'\b(INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|ATTACH|DETACH|PRAGMA|REINDEX|VACUUM|REPLACE|TRUNCATE)\b',
-    re.IGNORECASE
-)
+COLUMN_TYPE_PROBE = ColumnTypeProbe()
+
+class SandboxPool:
+    """
+    Pool of ready-to-use sandbox connections (see create_sandbox_db), so DML and create-tables submissions 
+    don't pay for building a sandbox inside the request. Sandboxes are single use: they are closed after 
+    the evaluation, and a background thread refills the pool as they are consumed.
+    Sandboxes built from an older DB_VERSION are discarded instead of handed out.
+    Hits (sandbox ready) and misses (built inside the request) are counted to help size the pool.
+    """
+
+    def __init__(self, size=SANDBOX_POOL_SIZE):
+        self.size = size
+        self._ready = collections.deque()  # (DB_VERSION, connection)
+        self._lock = threading.Lock()
+        self._refill_needed = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def start(self):
+        """
+        Starts the background refill thread and fills the pool.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refill_loop, name="sandbox-pool", daemon=True)
+            self._thread.start()
+        self._refill_needed.set()
+
+    def _refill_loop(self):
+        while True:
+            self._refill_needed.wait()
+            self._refill_needed.clear()
+            try:
+                while len(self._ready) < self.size:
+                    version = DB_VERSION
+                    conn = create_sandbox_db()
+                    with self._lock:
+                        self._ready.append((version, conn))
+            except Exception as e:
+                print("Error refilling sandbox pool:", e)
+
+    def acquire(self, row_factory=False):
+        """
+        Returns a sandbox connection, taken from the pool if one is ready, otherwise built on the spot.
+        """
+        conn = None
+        stale = []
+        with self._lock:
+            while self._ready:
+                version, candidate = self._ready.popleft()
+                if version == DB_VERSION:
+                    conn = candidate
+                    break
+                stale.append(candidate)
+            self.discarded += len(stale)
+            if conn is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        for candidate in stale:
+            candidate.close()
+        if self._thread is not None:
+            self._refill_needed.set()
+
+        if conn is None:
+            return create_sandbox_db(row_factory=row_factory)
+        if row_factory:
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def drain(self):
+        """
+        Closes all ready sandboxes (e.g. after the database was reloaded) and triggers a refill.
+        """
+        with self._lock:
+            ready = list(self._ready)
+            self._ready.clear()
+        for _, conn in ready:
+            conn.close()
+        if self._thread is not None:
+            self._refill_needed.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "ready": len(self._ready),
+                "hits": self.hits,
+                "misses": self.misses,
+                "discarded": self.discarded
+            }
+
+SANDBOX_POOL = SandboxPool()
+QUERY_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="sql-query")
+
+@contextlib.contextmanager
+def query_limits(conn, limits=None, cancel=None):
+    """
+    Enforces a wall-clock limit and a SQLite VM instruction budget on the statements run on conn inside the block.
+    A progress handler is called every PROGRESS_HANDLER_INTERVAL instructions, and interrupts the running statement 
+    as soon as either limit is exceeded, so runaway queries (e.g. an unbounded recursive CTE) stop instead of running on in the background.
+    Interrupted statements are re-raised as a TimeoutError describing the exceeded limit.
+    If a cancel event is given (see PreviewTracker), the statement is also interrupted once it is set, and re-raised as a QueryRejected (409).
+    Yields a state dict, whose "exceeded" field describes the exceeded limit (None while within the limits).
+    """
+    limits = limits or DEFAULT_QUERY_LIMITS
+    timeout = limits.get("timeout", QUERY_TIMEOUT)
+    instruction_budget = limits.get("instruction-budget", QUERY_INSTRUCTION_BUDGET)
+    deadline = time.monotonic() + timeout
+    state = {"instructions": 0, "exceeded": None}
+
+    def progress_handler():
+        if cancel is not None and cancel.is_set():
+            return 1
+        state["instructions"] += PROGRESS_HANDLER_INTERVAL
+        if state["instructions"] > instruction_budget:
+            state["exceeded"] = f"Query exceeded the limit of {instruction_budget} SQLite instructions"
+            return 1
+        if time.monotonic() > deadline:
+            state["exceeded"] = f"Query exceeded {timeout} seconds limit"
+            return 1
+        return 0
+
+    conn.set_progress_handler(progress_handler, PROGRESS_HANDLER_INTERVAL)
+    try:
+        yield state
+    except sqlite3.OperationalError as e:
+        if cancel is not None and cancel.is_set():
+            raise QueryRejected("Superseded by a newer preview", status=409) from e
+        if state["exceeded"]:
+            raise TimeoutError(state["exceeded"]) from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+# -------------------------------------
+# Query scheduling
+# -------------------------------------
+class QueryRejected(Exception):
+    """
+    Raised when a request is not run: shed by the QUERY_SCHEDULER (status 429), or superseded by a newer request 
+    of the same client (status 409). Answered with its status (see handle_query_rejected).
+    """
+
+    def __init__(self, message: str, status: int = 429):
+        super().__init__(message)
+        self.status = status
+
+class QueryScheduler:
+    """
+    Admission control in front of query execution. At most slots requests run queries at once, and waiting requests are 
+    admitted by priority (PRIORITY_EVALUATE, then PRIORITY_PREVIEW, then PRIORITY_TABLE), oldest first, so submissions 
+    stay fast while many editors are typing.
+        - A client (session id) runs at most client_slots requests at once, its other requests wait their turn
+        - Previews and table reads are shed (QueryRejected) instead of queued when shed_depth requests are already waiting,
+          or when they waited longer than their max_wait
+        - A waiting preview (or check) is stale once a newer one with the same supersede_key (of the same editor) arrives, 
+          e.g. the next keystroke's. Other requests are never superseded, so a client's parallel table reads or two editors both run
+    """
+
+    def __init__(self, slots=QUERY_WORKERS, client_slots=SCHEDULER_CLIENT_SLOTS, shed_depth=SCHEDULER_SHED_DEPTH, max_wait=SCHEDULER_MAX_WAIT):
+        self.slots = slots
+        self.client_slots = client_slots
+        self.shed_depth = shed_depth
+        self.max_wait = max_wait  # priority -> seconds a request may wait
+        self._lock = threading.Lock()
+        self._waiting = []  # heap of [priority, sequence number, client id, state, supersede key, condition of the waiter]
+        self._queued = 0  # entries in _waiting still waiting (stale and expired ones are dropped once they reach the top)
+        self._previews = {}  # (client id, supersede key) -> its waiting preview entry
+        self._running = collections.Counter()  # client id -> running requests
+        self._sequence = itertools.count()
+        self.admitted = collections.Counter()
+        self.shed = collections.Counter()
+
+    def _dispatch(self):
+        """
+        Admits waiting entries in priority order while slots are free, skipping clients at their cap, and wakes only the 
+        admitted waiters. Called with the lock held whenever a request arrives or a slot is released.
+        """
+        if len(self._waiting) > 2 * self._queued + 64:
+            self._waiting = [entry for entry in self._waiting if entry[3] == "waiting"]
+            heapq.heapify(self._waiting)
+        running = sum(self._running.values())
+        capped = []
+        while self._waiting and running < self.slots:
+            entry = heapq.heappop(self._waiting)
+            if entry[3] != "waiting":
+                continue
+            if self._running[entry[2]] >= self.client_slots:
+                capped.append(entry)
+                continue
+            entry[3] = "admitted"
+            self._queued -= 1
+            self._running[entry[2]] += 1
+            running += 1
+            entry[5].notify()
+        for entry in capped:
+            heapq.heappush(self._waiting, entry)
+
+    def acquire(self, priority: int, client_id: str, supersede_key=None):
+        """
+        Waits for a slot. Raises QueryRejected if the request is shed, or (409) if it is a preview superseded by a newer 
+        preview with the same supersede_key (the editor id) while waiting. Every successful acquire must be matched by a release.
+        """
+        with self._lock:
+            sheddable = priority != PRIORITY_EVALUATE
+            preview_key = (client_id, supersede_key) if priority == PRIORITY_PREVIEW and supersede_key is not None else None
+            previous = self._previews.get(preview_key) if preview_key else None
+            if previous is not None and previous[3] == "waiting":
+                # A newer preview of the same editor makes its waiting one stale
+                previous[3] = "stale"
+                self._queued -= 1
+                previous[5].notify()
+            if sheddable and self._queued >= self.shed_depth:
+                self.shed[priority] += 1
+                raise QueryRejected("The server is busy, please try again")
+
+            entry = [priority, next(self._sequence), client_id, "waiting", supersede_key, threading.Condition(self._lock)]
+            heapq.heappush(self._waiting, entry)
+            self._queued += 1
+            if preview_key:
+                self._previews[preview_key] = entry
+            self._dispatch()
+            deadline = time.monotonic() + self.max_wait[priority]
+            while entry[3] == "waiting":
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    entry[3] = "expired"
+                    self._queued -= 1
+                    break
+                entry[5].wait(remaining)
+            if preview_key and self._previews.get(preview_key) is entry:
+                del self._previews[preview_key]
+
+            if entry[3] != "admitted":
+                self.shed[priority] += 1
+                if entry[3] == "stale":
+                    raise QueryRejected("Superseded by a newer request", status=409)
+                raise QueryRejected("The server is busy, please try again")
+            self.admitted[priority] += 1
+
+    def release(self, client_id: str):
+        with self._lock:
+            self._running[client_id] -= 1
+            if self._running[client_id] <= 0:
+                del self._running[client_id]
+            self._dispatch()
+
+    @contextlib.contextmanager
+    def slot(self, priority: int, client_id: str, supersede_key=None):
+        """
+        Context manager which holds a slot for the duration of the block (see acquire).
+        """
+        self.acquire(priority, client_id, supersede_key)
+        try:
+            yield
+        finally:
+            self.release(client_id)
+
+    def stats(self):
+        names = {PRIORITY_EVALUATE: "evaluate", PRIORITY_PREVIEW: "preview", PRIORITY_TABLE: "table"}
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "running": sum(self._running.values()),
+                "waiting": self._queued,
+                "admitted": {names[p]: n for p, n in self.admitted.items()},
+                "shed": {names[p]: n for p, n in self.shed.items()}
+            }
+
+QUERY_SCHEDULER = QueryScheduler()
+
+@app.errorhandler(QueryRejected)
+def handle_query_rejected(e):
+    if e.status == 409:
+        return jsonify({"error": "Superseded", "message": str(e)}), 409
+    response = jsonify({"error": "Too many requests", "message": str(e)})
+    response.headers["Retry-After"] = "1"
+    return response, e.status
+
+class PreviewTracker:
+    """
+    Tracks the latest preview of each editor (a client's session id and the editor id it sends), so a newer preview 
+    supersedes the older one instead of waiting for it: the older preview's cancel event is set, which interrupts its 
+    running statement (see query_limits) and ends its streamed response. Previews arriving after a newer one of the 
+    same editor are stale. Editors are forgotten least recently used first, beyond max_editors.
+    """
+
+    def __init__(self, max_editors=PREVIEW_TRACKER_EDITORS):
+        self.max_editors = max_editors
+        self._latest = collections.OrderedDict()  # (client id, editor id) -> [seq, cancel event, running]
+        self._lock = threading.Lock()
+        self.superseded = 0
+        self.stale = 0
+
+    def begin(self, client_id: str, editor_id: str, seq: int):
+        """
+        Registers a preview, cancelling the editor's previous preview if it is still running.
+        Returns the new preview's cancel event, or None if the editor already sent a newer preview.
+        """
+        key = (client_id, editor_id)
+        with self._lock:
+            latest = self._latest.get(key)
+            if latest is not None:
+                if seq <= latest[0]:
+                    self.stale += 1
+                    return None
+                if latest[2]:
+                    latest[1].set()
+                    self.superseded += 1
+
+            cancel = threading.Event()
+            self._latest[key] = [seq, cancel, True]
+            self._latest.move_to_end(key)
+            while len(self._latest) > self.max_editors:
+                self._latest.popitem(last=False)
+            return cancel
+
+    def finish(self, client_id: str, editor_id: str, seq: int):
+        """
+        Marks a preview as finished, so a newer one doesn't count it as superseded.
+        """
+        with self._lock:
+            latest = self._latest.get((client_id, editor_id))
+            if latest is not None and latest[0] == seq:
+                latest[2] = False
+
+    def stats(self):
+        with self._lock:
+            return {"editors": len(self._latest), "superseded": self.superseded, "stale": self.stale}
+
+PREVIEW_TRACKER = PreviewTracker()
+
+# -------------------------------------
+# Live preview channels
+# -------------------------------------
+class LiveChannel:
+    """
+    A persistent live-preview channel of one editor: a Server-Sent Events stream (GET /lessons/live) that previews the 
+    query updates POSTed for the editor, and streams their results back in row batches.
+    Only the latest update is kept: an update arriving before the previous one was picked up replaces it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._update = None
+        self.closed = False
+
+    def push(self, update):
+        """
+        Queues an update (a dict with seq, query, limits and cancel event), replacing any update not yet picked up. None clears it.
+        """
+        with self._cond:
+            self._update = update
+            self._cond.notify()
+
+    def next(self, timeout: float):
+        """
+        Waits up to timeout seconds for an update. Returns it, or None.
+        """
+        with self._cond:
+            if self._update is None and not self.closed:
+                self._cond.wait(timeout)
+            update, self._update = self._update, None
+            return update
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+class LiveChannelRegistry:
+    """
+    The open LiveChannels, keyed by (client id, editor id). An editor reconnecting replaces (and closes) its previous channel.
+    Each open channel holds a request thread, so at most limit channels are open at once. Beyond that, editors are refused 
+    and preview with POST /lessons/preview instead. A limit of 0 disables channels.
+    """
+
+    def __init__(self, limit=LIVE_CHANNEL_LIMIT):
+        self.limit = limit
+        self._channels = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.refused = 0
+
+    def open(self, client_id: str, editor_id: str):
+        """
+        Opens the editor's channel, replacing its previous one. Returns the LiveChannel, or None if the limit is reached.
+        """
+        channel = LiveChannel()
+        with self._lock:
+            previous = self._channels.get((client_id, editor_id))
+            if previous is None and len(self._channels) >= self.limit:
+                self.refused += 1
+                return None
+            self._channels[(client_id, editor_id)] = channel
+            self.opened += 1
+        if previous is not None:
+            previous.close()
+        return channel
+
+    def get(self, client_id: str, editor_id: str):
+        with self._lock:
+            return self._channels.get((client_id, editor_id))
+
+    def remove(self, client_id: str, editor_id: str, channel: LiveChannel):
+        channel.close()
+        with self._lock:
+            if self._channels.get((client_id, editor_id)) is channel:
+                del self._channels[(client_id, editor_id)]
+
+    def stats(self):
+        with self._lock:
+            return {"open": len(self._channels), "limit": self.limit, "opened": self.opened, "refused": self.refused}
+
+LIVE_CHANNELS = LiveChannelRegistry()
+
+def sse_event(event: str, data: dict) -> str:
+    """
+    Formats a Server-Sent Event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=json_value)}\n\n"
+
+def live_preview_events(client_id: str, editor_id: str, update: dict):
+    """
+    Runs a live-preview update in a QUERY_SCHEDULER slot, yielding its results as Server-Sent Events:
+        columns {"seq", "columns"}, then rows {"seq", "rows"} per STREAM_BATCH_SIZE rows, then done {"seq", "row-count"}
+    or cancelled {"seq"} if a newer update (or a cancel) supersedes it, or error {"seq", "error", "message"}.
+    """
+    seq, cancel = update["seq"], update["cancel"]
+    try:
+        with QUERY_SCHEDULER.slot(PRIORITY_PREVIEW, client_id, editor_id), READONLY_POOL.connection() as conn, \
+                query_limits(conn, update["limits"], cancel):
+            conn.row_factory = None
+            cur = conn.execute(apply_row_limit(update["query"], PREVIEW_ROW_LIMIT))
+            yield sse_event("columns", {"seq": seq, "columns": [d[0] for d in cur.description]})
+
+            row_count = 0
+            while True:
+                if cancel.is_set():
+                    raise QueryRejected("Superseded by a newer preview", status=409)
+                batch = cur.fetchmany(STREAM_BATCH_SIZE)
+                if not batch:
+                    break
+                row_count += len(batch)
+                rows = [["NULL" if value is None else value for value in row] for row in batch]
+                yield sse_event("rows", {"seq": seq, "rows": rows})
+            yield sse_event("done", {"seq": seq, "row-count": row_count})
+
+    except QueryRejected as e:
+        if e.status == 409:
+            yield sse_event("cancelled", {"seq": seq})
+        else:
+            yield sse_event("error", {"seq": seq, "error": "Too many requests", "message": str(e)})
+    except Exception as e:
+        print(e)
+        yield sse_event("error", {"seq": seq, "error": "Invalid SQL query", "message": str(e)})
+    finally:
+        PREVIEW_TRACKER.finish(client_id, editor_id, seq)
 
 # -------------------------------------
 # Setup
@@ -81,15 +1704,16 @@ def detect_and_validate_lessons():
             - Check no duplicate lesson-ids, or task-ids exist
             - Check lesson.json and content.md files are in the folder
             - Check all fields in the template.json file are in the lesson.json file 
-    
+    The validated lessons are published to the LESSON_CATALOG. Files are read through the catalog, so 
+    when this is re-run after a lesson file is edited, only the changed files are re-parsed.
     """
     global LESSON_LIST, TASKS_LIST
-    LESSON_LIST = []
-    TASKS_LIST = []
 
     detected_lessons = set()
     detected_tasks = set()
     tmp_lessons = {}
+    validated_lessons = {}
+    overview_entries = {}
 
     RED = '\033[31m'
     GREEN = '\033[32m'
@@ -103,8 +1727,7 @@ def detect_and_validate_lessons():
     for folder in LESSON_ROOT.iterdir():
         if folder.is_dir() and folder.name == "template-lesson":
             lesson_json_path = folder / "lesson.json"
-            with open(lesson_json_path, "r", encoding="utf-8") as f:
-                template_lesson_json = json.load(f)
+            template_lesson_json = LESSON_CATALOG.read_json(lesson_json_path)
             break
 
     if template_lesson_json is None:
@@ -117,8 +1740,22 @@ def detect_and_validate_lessons():
     # Load the lessons overview
     # -----------------------------------------
     lesson_overview_path = LESSON_ROOT / "lessons-overview.json"
-    with open(lesson_overview_path, "r", encoding="utf-8") as lesson_overview_file:
-        lesson_overview_json = json.load(lesson_overview_file)
+    lesson_overview_json = LESSON_CATALOG.read_json(lesson_overview_path)
+
+    def keep_previous_lesson(lesson_id: str, lesson: dict):
+        """
+        Keeps the previously published version of a lesson that failed validation (e.g. a lesson.json saved mid-edit), 
+        so students on it aren't cut off until the edit is finished. At startup there is no previous version, and the lesson is skipped.
+        """
+        previous = LESSON_CATALOG.lessons.get(lesson_id)
+        if previous is None:
+            return
+        print(f"{YELLOW}{lesson_id} failed validation, keeping its previously loaded version{RESET}")
+        for task in previous.get("exercise-tasks") or []:
+            detected_tasks.add(task.get("task-id"))
+        tmp_lessons[lesson_id] = {"order": lesson["lesson-order"], "lesson": lesson_id}
+        validated_lessons[lesson_id] = previous
+        overview_entries[lesson_id] = lesson
 
     # -----------------------------------------
     # Validate all lessons
@@ -146,10 +1783,10 @@ def detect_and_validate_lessons():
         lesson_json_path = folder / "lesson.json"
         if not lesson_json_path.exists():
             print(f"{RED}{folder} skipped: missing lesson.json{RESET}")
+            keep_previous_lesson(lesson_id, lesson)
             continue
 
-        with open(lesson_json_path, "r", encoding="utf-8") as f:
-            lesson_json = json.load(f)
+        lesson_json = LESSON_CATALOG.read_json(lesson_json_path)
 
         missing_field = False
 
@@ -189,6 +1826,7 @@ def detect_and_validate_lessons():
 
 
         if missing_field:
+            keep_previous_lesson(lesson_id, lesson)
             continue
 
         # Valid lesson
@@ -196,6 +1834,8 @@ def detect_and_validate_lessons():
             "order": lesson["lesson-order"],
             "lesson": lesson_id
         }
+        validated_lessons[lesson_id] = lesson_json
+        overview_entries[lesson_id] = lesson
 
         print(f"{GREEN}Validated lesson: {lesson_id}{RESET}")
 
@@ -203,7 +1843,9 @@ def detect_and_validate_lessons():
     # Final ordering
     # -----------------------------------------
     sorted_lessons = sorted(tmp_lessons.values(), key=lambda item: item["order"])
-    LESSON_LIST = [entry["lesson"] for entry in sorted_lessons]
+    lesson_list = [entry["lesson"] for entry in sorted_lessons]
+    LESSON_CATALOG.publish(validated_lessons, overview_entries, lesson_list)
+    LESSON_LIST = lesson_list
     TASKS_LIST = list(detected_tasks)
 
     print(f"{YELLOW}Loaded {len(LESSON_LIST)} lessons successfully.{RESET}")
@@ -212,8 +1854,9 @@ def run_init_sql():
     """
     Initializes the SQLite in-memory DB using the SQL startup script (INIT_SQL_PATH)
     Sets the global _db_initialised boolean flag to true to ensure database is only initialsed once.
+    Each successful load increments DB_VERSION, which invalidates any cached query results.
     """
-    global _db_initialized
+    global _db_initialized, DB_VERSION
     if _db_initialized:
         return
     _db_initialized = True
@@ -228,6 +1871,11 @@ def run_init_sql():
         cursor = DB_INIT_CONN.cursor()
         cursor.executescript(sql_script)
         DB_INIT_CONN.commit()
+        DB_VERSION += 1
+        EXPECTED_RESULTS.clear()
+        PREVIEW_CACHE.clear()
+        VERDICT_CACHE.clear()
+        SANDBOX_POOL.drain()
         print("SQLite in-memory database initialized successfully.")
     except Exception as e:
         print("Error running init.sql:", e)
@@ -255,6 +1903,64 @@ def load_database_tables():
         DATABASE_TABLES = []
         return []
 
+def warm_up_expected_results(workers=WARM_UP_WORKERS, strict=False):
+    """
+    Optional startup phase, run after the lessons are validated and the database is initialised.
+    Submits every task's correct-query through the normal evaluation path, using a pool of worker threads 
+    (each evaluation runs on its own connection / sandbox). This:
+        - Fills the expected result caches, so the first submission of a task costs the same as every later one
+        - Self-checks each task: the correct-query must match the task's own verify-query
+        - Reports how long each task takes to evaluate, so slow reference queries are found before students hit them
+    Failed self-checks are printed as warnings, or raise an ImportError if strict is True.
+    Returns a list of {"task-id", "lesson-id", "ok", "error", "seconds"} dicts, slowest first.
+    """
+    RED = '\033[31m'
+    GREEN = '\033[32m'
+    YELLOW = '\033[33m'
+    RESET = '\033[0m'
+
+    def check_task(task_record):
+        task = task_record["task"]
+        start = time.perf_counter()
+        try:
+            results_match, error, _ = evaluate_task(task_record, task.get("correct-query"))
+        except Exception as e:
+            results_match, error = False, str(e)
+        return {
+            "task-id": task.get("task-id"),
+            "lesson-id": task_record["lesson-id"],
+            "ok": bool(results_match) and not error,
+            "error": error,
+            "seconds": time.perf_counter() - start
+        }
+
+    start = time.perf_counter()
+    task_records = list(LESSON_CATALOG.task_index.values())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        report = list(executor.map(check_task, task_records))
+    report.sort(key=lambda item: item["seconds"], reverse=True)
+
+    failures = [item for item in report if not item["ok"]]
+    for item in report:
+        if item["seconds"] >= SLOW_TASK_WARNING:
+            print(f"{YELLOW}Slow task {item['task-id']} ({item['lesson-id']}): {item['seconds']:.3f}s{RESET}")
+    for item in failures:
+        reason = item["error"] or "correct-query does not match verify-query"
+        print(f"{RED}Task {item['task-id']} ({item['lesson-id']}) failed its self-check: {reason}{RESET}")
+
+    print(
+        f"{GREEN if not failures else YELLOW}Warmed up {len(report)} tasks in {time.perf_counter() - start:.2f}s "
+        f"({len(failures)} failed self-checks){RESET}"
+    )
+    if report:
+        slowest = report[0]
+        print(f"Slowest task: {slowest['task-id']} ({slowest['lesson-id']}) {slowest['seconds']:.3f}s")
+
+    if strict and failures:
+        raise ImportError(f"{len(failures)} tasks failed their warm up self-check")
+
+    return report
+
 def check_if_running(url=APP_URL):
     """
     Makes a request to the APP_URL to determine if the app is already running 
@@ -266,38 +1972,39 @@ def check_if_running(url=APP_URL):
     except requests.RequestException:
         return False
 
-def get_db_connection():
+def get_seed_image():
     """
-    Creates a database connection 
-    Ensures the connection using row factory, which converts result tuples into more useful objects.
+    Returns a serialized copy (bytes) of the main in-memory DB for the current DB_VERSION.
+    The image is taken once per DB_VERSION and shared by every sandbox.
     """
-    conn = sqlite3.connect(DB_PATH, uri=True)
-    conn.row_factory = sqlite3.Row
-    return conn
+    global SEED_IMAGE
+    image = SEED_IMAGE
+    if image is not None and image[0] == DB_VERSION:
+        return image[1]
+
+    with SEED_IMAGE_LOCK:
+        if SEED_IMAGE is None or SEED_IMAGE[0] != DB_VERSION:
+            SEED_IMAGE = (DB_VERSION, DB_INIT_CONN.serialize())
+        return SEED_IMAGE[1]
 
 def create_sandbox_db(row_factory=False):
     """
-    Creates a temporary sandbox SQLite DB file and copies 
+    Creates a private in-memory sandbox SQLite DB containing 
     the entire schema + data from the main in-memory DB.
-    Returns: (connection, temp_file_path)
+    The sandbox is loaded from the serialized seed image, so no files are created or cleaned up. 
+    Closing the connection discards the sandbox.
+    Returns: connection
     """
-    # Create temp file for the sandbox database
-    tmpfile = tempfile.NamedTemporaryFile(delete=False)
-    tmpfile.close()  # SQLite requires the file to exist but not be open
-
-    # Create connection to sandbox DB
-    sandbox_conn = sqlite3.connect(tmpfile.name)
+    sandbox_conn = sqlite3.connect(":memory:", check_same_thread=False)
 
     # Enable row-as-dict mode if requested
     if row_factory:
         sandbox_conn.row_factory = sqlite3.Row
 
     # Copy schema + data from the main initialized DB
-    source = DB_INIT_CONN
-    source.backup(sandbox_conn)
-    sandbox_conn.commit()
+    sandbox_conn.deserialize(get_seed_image())
 
-    return sandbox_conn, tmpfile.name
+    return sandbox_conn
 
 # -------------------------------------
 # Helpers
@@ -307,22 +2014,23 @@ def http_error(status, message):
     abort(status, description=message)
 
 def load_lesson(lesson_id: str):
-    """Load lesson folder + JSON definition."""
-    if lesson_id not in LESSON_LIST:
-        http_error(404, "Lesson not found")
-
-    lesson_dir = LESSON_ROOT / lesson_id
-    if not lesson_dir.exists():
+    """
+    Load lesson folder + JSON definition from the LESSON_CATALOG.
+    The returned lesson is shared between requests, so it must not be modified.
+    """
+    LESSON_CATALOG.refresh()
+    lesson = LESSON_CATALOG.lessons.get(lesson_id)
+    if lesson is None:
         http_error(404, "Lesson not found")
 
-    lesson_json_path = lesson_dir / "lesson.json"
-    if not lesson_json_path.exists():
-        http_error(500, "lesson.json missing")
+    return lesson, LESSON_ROOT / lesson_id
 
-    with open(lesson_json_path, "r") as f:
-        lesson = json.load(f)
-
-    return lesson, lesson_dir
+def get_task(lesson_id: str, task_id: float):
+    """
+    Returns the task record (see build_task_record) for a task in a lesson, or None if the task is not part of that lesson.
+    """
+    LESSON_CATALOG.refresh()
+    return LESSON_CATALOG.task_index.get((lesson_id, task_id))
 
 def load_lesson_markdown(lesson_id: str):
     """
@@ -337,35 +2045,12 @@ def load_lesson_markdown(lesson_id: str):
         http_error(500, "content.md missing")
 
     try:
-        with open(md_path, "r", encoding="utf-8") as f:
-            markdown = f.read()
+        markdown = LESSON_CATALOG.read_text(md_path)
     except Exception as e:
         http_error(500, f"Failed to read content.md: {e}")
 
     return markdown, lesson_dir
 
-def get_lesson_difficulty(lesson_id: str): 
-    if lesson_id not in LESSON_LIST:
-        http_error(404, "Lesson not found")
-
-    lesson_overview_json_path = LESSON_ROOT / "lessons-overview.json"
-    if not lesson_overview_json_path.exists():
-        http_error(404, "Lesson not found")
-
-    lesson_overview = None
-    with open(lesson_overview_json_path, "r") as f:
-        lesson_overview = json.load(f)
-
-    if not lesson_overview:
-        return "Unable to find"
-    
-    lessons_list = lesson_overview.get("lessons") 
-    for lesson in lessons_list: 
-        if lesson.get("lesson-id") == lesson_id:
-            return lesson.get("difficulty")
-        
-    return ""
-
 # ------------- Database reads/writes -------------
 def read_db_table(table_name: str):
     """
@@ -375,11 +2060,9 @@ def read_db_table(table_name: str):
         return {"status": 404, "error": f"Invalid table name: {table_name}"}
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        query = f"SELECT * FROM {table_name}"
-        rows = cursor.execute(query).fetchall()
+        with READONLY_POOL.connection() as conn:
+            query = f"SELECT * FROM {table_name}"
+            rows = conn.execute(query).fetchall()
 
         results = []
         for row in rows:
@@ -394,13 +2077,17 @@ def read_db_table(table_name: str):
         return {"error": str(e)}
 
 def execute_with_timeout(func, *args, timeout=QUERY_TIMEOUT, **kwargs):
-    """Run any function in a separate thread with a hard timeout."""
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(func, *args, **kwargs)
-        try:
-            return future.result(timeout=timeout)
-        except concurrent.futures.TimeoutError:
-            raise TimeoutError(f"Query exceeded {timeout} seconds limit")
+    """
+    Run a query function on the long-lived QUERY_EXECUTOR and wait for its result.
+    The statements themselves are interrupted by query_limits, so waiting past the timeout only 
+    happens if the executor is saturated.
+    """
+    future = QUERY_EXECUTOR.submit(func, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout * 2)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError(f"Query exceeded {timeout} seconds limit")
 
 def get_db_table_columns(table_name: str):
     """
@@ -410,11 +2097,8 @@ def get_db_table_columns(table_name: str):
         return {"status": 404, "error": f"Invalid table name: {table_name}"}
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        cur.execute(f"PRAGMA table_info({table_name})")
-        rows = cur.fetchall()
+        with READONLY_POOL.connection() as conn:
+            rows = conn.execute(f"PRAGMA table_info({table_name})").fetchall()
 
         if not rows:
             return {"status": 404, "error": f"Table not found or has no columns: {table_name}"}
@@ -428,119 +2112,192 @@ def get_db_table_columns(table_name: str):
 
 def is_select_only(sql: str):
     """
-    Validate SQL is a single SELECT (or WITH ... SELECT), no writes/DDL, and no multiple statements.
+    Validate SQL is a single SELECT (or WITH ... SELECT) statement.
+    Checks are made on the query's tokens (see sql_lexer), so semicolons inside strings or comments are ignored.
+    Writes and DDL are not looked for here: read-only connections refuse to compile them (see readonly_authorizer).
     Returns (True, "") on ok, otherwise (False, message).
     """
-    if not sql or not isinstance(sql, str) or not sql.strip():
+    if not sql or not isinstance(sql, str):
         return False, "Empty query."
 
-    s = sql.strip()
-
-    # Quick reject forbidden keywords
-    if FORBIDDEN_SQL_RE.search(s):
-        return False, "Query contains forbidden statement (writes or DDL are not allowed)."
+    lexed = lex(sql)
+    if not lexed.statements:
+        return False, "Empty query."
 
-    # Disallow multiple statements: allow single trailing semicolon only
-    # Count semicolons; if >1 reject. If 1, ensure it's trailing.
-    sc_count = s.count(';')
-    if sc_count > 1:
-        return False, "Multiple statements not allowed."
-    if sc_count == 1 and not s.rstrip().endswith(';'):
+    # Disallow multiple statements (a trailing semicolon is fine)
+    if len(lexed.statements) > 1:
         return False, "Multiple statements not allowed."
 
-    # Remove trailing semicolon for further checks
-    if s.endswith(';'):
-        s = s.rstrip()[:-1].strip()
-
     # Ensure it starts with SELECT or WITH
-    if not re.match(r'^(WITH\s+|SELECT\s+)', s, re.IGNORECASE):
+    if lexed.leading_keyword not in ("SELECT", "WITH"):
         return False, "Only SELECT queries are allowed."
 
     return True, ""
 
-def run_readonly_query(sql: str, row_limit: int = 200):
+def run_readonly_rows(sql: str, consume, row_limit: int = 200, limits=None):
     """
-    Executes a validated SELECT query safely and returns
-    ({ "columns": [...], "rows": [...] }, error_msg).
-    Uses the shared in-memory DB connection.
+    Executes a validated SELECT query safely on a pooled read-only connection, with the query_limits applied.
+    The rows are not materialised: consume(rows, columns) is called with the open cursor (rows are plain tuples) and the column names, 
+    and its return value is returned as (result, error_msg).
     """
     try:
-        s = sql.strip()
-        if s.endswith(';'):
-            s = s[:-1].strip()
+        final_sql = apply_row_limit(sql, row_limit)
 
-        # Add LIMIT if missing
-        if not re.search(r'\bLIMIT\b', s, re.IGNORECASE):
-            final_sql = f"{s} LIMIT {row_limit}"
-        else:
-            final_sql = s
+        with READONLY_POOL.connection() as conn, query_limits(conn, limits):
+            conn.row_factory = None
+            cur = conn.execute(final_sql)
+            return consume(cur, [d[0] for d in cur.description]), None
 
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute(final_sql)
+    except Exception as e:
+        print(e)
+        return None, str(e)
 
-        col_order = [desc[0] for desc in cur.description]
+def apply_row_limit(sql: str, row_limit):
+    """
+    Removes comments and any trailing semicolon, and appends a LIMIT to the query if it does not have a top-level one.
+    A row_limit of None leaves the query unlimited. Text with several statements is returned without comments, but otherwise unchanged.
+    """
+    lexed = lex(sql)
+    if len(lexed.statements) != 1:
+        return lexed.text
 
-        rows_raw = cur.fetchall()
-        rows = []
+    s = lexed.statements[0]
 
-        for row in rows_raw:
-            row_dict = {}
-            for col in col_order:
-                val = row[col]
-                row_dict[col] = "NULL" if val is None else val
-            rows.append(row_dict)
+    # Add LIMIT if missing
+    if row_limit is not None and not lexed.has_limit:
+        return f"{s} LIMIT {row_limit}"
+    return s
+
+def json_value(value):
+    """
+    JSON serializer for values the json module can't handle (BLOBs are sent as hex).
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
 
-        return col_order, rows, None
+def stream_readonly_query(sql: str, row_limit: int = 200, limits=None, cache=None, cancel=None):
+    """
+    Executes a validated SELECT query and streams the results as a column-oriented JSON response:
+        {"results": {"columns": [...], "rows": [[...], [...]]}}
+    Rows are fetched and serialized STREAM_BATCH_SIZE at a time, so memory use does not grow with the number of rows.
+    The first batch is fetched up front, so SQL errors are returned as (None, error_msg) rather than part way through a response.
+    An error after the response has started (e.g. the query running over its limits) ends the stream with an "error" field.
+    If a cache (a PreviewCache) is given, complete responses are stored in it (cached responses are sent by schedule_stream).
+    If a cancel event is given, setting it interrupts the query (see query_limits), and ends the stream with an "error" field.
+    Returns (response, error_msg). The pooled connection is held until the response is finished or closed.
+    """
+    final_sql = apply_row_limit(sql, row_limit)
+    cache_key = cache.key(final_sql, row_limit) if cache is not None else None
 
+    stack = contextlib.ExitStack()
+    limit_state = {}
+    try:
+        conn = stack.enter_context(READONLY_POOL.connection())
+        limit_state = stack.enter_context(query_limits(conn, limits, cancel))
+        conn.row_factory = None
+        cur = conn.execute(final_sql)
+        columns = [desc[0] for desc in cur.description]
+        batch = cur.fetchmany(STREAM_BATCH_SIZE)
     except Exception as e:
+        stack.close()
+        # The statement ran outside the query_limits block, so its interruption is reported here
+        if cancel is not None and cancel.is_set():
+            raise QueryRejected("Superseded by a newer preview", status=409) from e
         print(e)
-        return None, None, str(e)
-
-def safe_run_readonly(sql: str, row_limit=200):
-    """Run a SELECT / read-only query safely with timeout."""
-    return execute_with_timeout(run_readonly_query, sql, row_limit=row_limit)
-
-def normalize_and_sort_rows(rows):
+        return None, limit_state.get("exceeded") or str(e)
+
+    def generate():
+        with stack:
+            nonlocal batch
+            # Copy of the chunks sent, for the cache (dropped if it grows larger than the cache)
+            parts = [] if cache_key is not None else None
+            size = 0
+
+            def chunk(text):
+                nonlocal parts, size
+                if parts is not None:
+                    parts.append(text)
+                    size += len(text)
+                    if size > cache.max_bytes:
+                        parts = None
+                return text
+
+            yield chunk('{"results":{"columns":' + json.dumps(columns) + ',"rows":[')
+            separator = ""
+            try:
+                while batch:
+                    if cancel is not None and cancel.is_set():
+                        raise QueryRejected("Superseded by a newer preview", status=409)
+                    yield chunk(separator + ",".join(
+                        json.dumps(["NULL" if value is None else value for value in row], default=json_value)
+                        for row in batch
+                    ))
+                    separator = ","
+                    batch = cur.fetchmany(STREAM_BATCH_SIZE)
+            except Exception as e:
+                message = str(e) if isinstance(e, QueryRejected) else limit_state["exceeded"] or str(e)
+                yield ']},"error":' + json.dumps(message) + '}'
+                return
+            yield chunk(']}}')
+            if parts is not None:
+                cache.put(cache_key, "".join(parts).encode("utf-8"))
+
+    response = Response(generate(), mimetype="application/json")
+    # Return the connection to the pool even if the response is never iterated
+    response.call_on_close(stack.close)
+    return response, None
+
+def schedule_stream(priority: int, sql: str, row_limit: int = 200, limits=None, cache=None, cancel=None, supersede_key=None):
     """
-    Normalize rows: convert each row dict to tuple of values in column order provided by row.keys().
-    Return (columns_tuple, sorted_rows_tuple_of_tuples). Sorting uses stringification fallback.
+    Runs stream_readonly_query in a QUERY_SCHEDULER slot for the requesting client, held until the response is finished or closed.
+    A response found in the cache is sent without taking a slot, so it is never queued, shed or counted against the client's cap.
+    Raises QueryRejected if the request is shed, superseded (see QueryScheduler.acquire) or cancelled. Returns (response, error_msg).
     """
-    if not rows:
-        return (), tuple()
-
-    cols = tuple(rows[0].keys())
-
-    def convert_value(v):
-        if isinstance(v, (bytes, bytearray)):
-            return v.hex()
-        return v
-
-    tuple_rows = []
-    for r in rows:
-        tuple_rows.append(tuple(convert_value(r.get(c)) for c in cols))
+    if cache is not None:
+        payload = cache.get(cache.key(apply_row_limit(sql, row_limit), row_limit))
+        if payload is not None:
+            return Response(payload, mimetype="application/json"), None
 
+    client_id = g.session_id
+    QUERY_SCHEDULER.acquire(priority, client_id, supersede_key)
     try:
-        sorted_rows = tuple(sorted(tuple_rows))
-    except TypeError:
-        sorted_rows = tuple(sorted(tuple_rows, key=lambda t: tuple(str(x) for x in t)))
+        response, err = stream_readonly_query(sql, row_limit=row_limit, limits=limits, cache=cache, cancel=cancel)
+    except BaseException:
+        QUERY_SCHEDULER.release(client_id)
+        raise
+    if err:
+        QUERY_SCHEDULER.release(client_id)
+        return None, err
 
-    return cols, sorted_rows
+    response.call_on_close(lambda: QUERY_SCHEDULER.release(client_id))
+    return response, None
 
-def remap_rows_to_columns(rows, target_cols):
+def check_query(sql: str, limits=None):
     """
-    Given rows as list[dict], and target_cols (iterable of column names),
-    return sorted tuple of tuples where each inner tuple contains values in target_cols order.
+    Compiles a validated SELECT query without running it, so no rows are read or produced:
+        - its EXPLAIN QUERY PLAN is taken on a pooled read-only connection (so the readonly_authorizer applies)
+        - its result columns and their declared types come from the COLUMN_TYPE_PROBE
+    Returns ({"columns": [{"name", "type"}], "plan": [{"id", "parent", "detail"}]}, None), or (None, error_msg) if it doesn't compile.
     """
-    if not rows:
-        return tuple()
-    mapped = []
-    for r in rows:
-        mapped.append(tuple(r.get(c) for c in target_cols))
+    final_sql = subquery_sql(sql)
     try:
-        return tuple(sorted(mapped))
-    except TypeError:
-        return tuple(sorted(mapped, key=lambda t: tuple(str(x) for x in t)))
+        with READONLY_POOL.connection() as conn, query_limits(conn, limits):
+            conn.row_factory = None
+            plan = [
+                {"id": row[0], "parent": row[1], "detail": row[3]}
+                for row in conn.execute(f"EXPLAIN QUERY PLAN {final_sql}")
+            ]
+        columns = COLUMN_TYPE_PROBE.columns(final_sql, limits)
+    except Exception as e:
+        return None, str(e)
+
+    return {"columns": columns, "plan": plan}, None
+
+def safe_run_readonly_rows(sql: str, consume, row_limit=200, limits=None):
+    """Run a SELECT / read-only query safely with timeout (see run_readonly_rows)."""
+    limits = limits or DEFAULT_QUERY_LIMITS
+    return execute_with_timeout(run_readonly_rows, sql, consume, row_limit=row_limit, limits=limits, timeout=limits["timeout"])
 
 def format_timedelta(td):
     total_seconds = int(td.total_seconds())
@@ -551,24 +2308,12 @@ def format_timedelta(td):
 
 def strip_sql_comments(sql: str) -> str:
     """
-    Removes any comments from an SQL query string
+    Removes any comments from an SQL query string (comment markers inside strings are left alone)
     """
     if not sql:
         return sql
 
-    # Remove /* multi-line */ comments
-    sql = re.sub(r"/\*.*?\*/", "", sql, flags=re.DOTALL)
-
-    # Remove -- single-line comments
-    sql = re.sub(r"--.*?$", "", sql, flags=re.MULTILINE)
-
-    # Strip whitespace
-    return sql.strip()
-
-def dict_rows(cursor):
-    """Convert sqlite3.Row rows into plain dicts."""
-    cols = [d[0] for d in cursor.description]
-    return [{col: row[col] for col in cols} for row in cursor.fetchall()]
+    return lex(sql).text
 
 def replace_nulls(obj):
     """Recursively convert None → '' for safe frontend use."""
@@ -580,144 +2325,387 @@ def replace_nulls(obj):
         return ""
     return obj
 
-def rows_to_tuples(rows):
-    """Convert dict → tuple(values) (column names ignored)."""
-    return [tuple(row.values()) for row in rows]
+# ------------- Result comparison -------------
+def normalize_row(row):
+    """
+    Converts a result row (tuple, sqlite3.Row or dict) into a hashable tuple of values. Column names are ignored.
+    """
+    values = row.values() if isinstance(row, dict) else row
+    return tuple(bytes(value) if isinstance(value, (bytearray, memoryview)) else value for value in values)
+
+def build_expected_rows(rows, columns: list, order_sensitive: bool, max_rows=None):
+    """
+    Builds the form expected results are compared (and cached) in:
+        {"columns": list, "column_count": int, "row_count": int, "order_sensitive": bool, "rows": ...}
+    where rows is a Counter (multiset) of the row tuples, or the list of row tuples when the order matters.
+    If there are more than max_rows rows, they are not kept: rows and row_count are None, and the results
+    have to be graded inside SQLite instead (see grade_in_sqlite).
+    """
+    if max_rows is not None:
+        rows = list(itertools.islice(rows, max_rows + 1))
+        if len(rows) > max_rows:
+            return {
+                "columns": columns, "column_count": len(columns), "row_count": None, "order_sensitive": order_sensitive, "rows": None
+            }
+
+    if order_sensitive:
+        expected_rows = [normalize_row(row) for row in rows]
+        row_count = len(expected_rows)
+    else:
+        expected_rows = collections.Counter(normalize_row(row) for row in rows)
+        row_count = expected_rows.total()
+
+    return {
+        "columns": columns,
+        "column_count": len(columns),
+        "row_count": row_count,
+        "order_sensitive": order_sensitive,
+        "rows": expected_rows
+    }
+
+def compare_rows(rows, columns: list, expected: dict) -> bool:
+    """
+    Compares result rows against expected rows from build_expected_rows. Returns True if they match.
+    rows can be any iterable (e.g. an open cursor), it is consumed lazily and the comparison stops at the first difference:
+        - Fails fast if the number of columns differs, or as soon as there are more rows than expected
+        - Order sensitive results are compared row by row
+        - Other results are counted against the expected multiset, which takes linear time and works for 
+          mixed value types (no sorting, so no str() fallback is needed)
+    """
+    if len(columns) != expected["column_count"]:
+        return False
+
+    expected_rows = expected["rows"]
+    expected_count = expected["row_count"]
+    row_count = 0
+
+    if expected["order_sensitive"]:
+        for row in rows:
+            if row_count >= expected_count or normalize_row(row) != expected_rows[row_count]:
+                return False
+            row_count += 1
+        return row_count == expected_count
+
+    seen = collections.Counter()
+    for row in rows:
+        row_count += 1
+        if row_count > expected_count:
+            return False
+        key = normalize_row(row)
+        seen[key] += 1
+        if seen[key] > expected_rows.get(key, 0):
+            return False
+    return row_count == expected_count
+
+def compare_ordered_rows(rows, expected_rows) -> bool:
+    """
+    Compares two iterables of rows (e.g. two open cursors) in order, consuming both lazily. Returns True if they match.
+    """
+    missing = object()
+    for row, expected_row in itertools.zip_longest(rows, expected_rows, fillvalue=missing):
+        if row is missing or expected_row is missing or normalize_row(row) != normalize_row(expected_row):
+            return False
+    return True
+
+def subquery_sql(sql: str) -> str:
+    """
+    Prepares a query to be wrapped as a subquery: comments and any trailing semicolon are removed.
+    """
+    return apply_row_limit(sql, None)
+
+def query_columns(conn, sql: str) -> list:
+    """
+    Returns the names of the columns a query returns, without running it.
+    """
+    return [d[0] for d in conn.execute(f"SELECT * FROM (\n{subquery_sql(sql)}\n) LIMIT 0").description]
+
+def diff_in_sqlite(conn, user_query: str, verify_query: str, column_count: int, limit=None):
+    """
+    Computes the difference between the user and verify-query results inside SQLite, returning a cursor over (up to limit) mismatching rows.
+    EXCEPT ALL is emulated by tagging each side's rows with a count, grouping on every column and keeping the groups 
+    where the counts differ. Each returned row is (values..., user_count, expected_count), so no rows are returned if the results match.
+    Both queries must return column_count columns.
+    """
+    cols = ", ".join(f"c{i}" for i in range(column_count))
+    sql = f"""
+        WITH u({cols}) AS (
+            {subquery_sql(user_query)}
+        ), e({cols}) AS (
+            {subquery_sql(verify_query)}
+        )
+        SELECT {cols}, SUM(nu), SUM(ne) FROM (
+            SELECT *, 1 AS nu, 0 AS ne FROM u
+            UNION ALL
+            SELECT *, 0, 1 FROM e
+        )
+        GROUP BY {cols}
+        HAVING SUM(nu) != SUM(ne)
+    """
+    if limit is not None:
+        sql += f"LIMIT {int(limit)}"
+    return conn.execute(sql)
+
+def grade_in_sqlite(user_query: str, verify_query: str, column_count: int, order_sensitive: bool, limits=None):
+    """
+    Compares the user query against the verify-query on a pooled read-only connection, without holding either result in Python.
+    Order insensitive results are diffed by SQLite (see diff_in_sqlite), ordered results are streamed side by side.
+    Returns (results_match, error_msg).
+    """
+    try:
+        with READONLY_POOL.connection() as conn, query_limits(conn, limits):
+            conn.row_factory = None
+            if len(query_columns(conn, user_query)) != column_count:
+                return False, None
+
+            if order_sensitive:
+                user_rows = conn.execute(subquery_sql(user_query))
+                expected_rows = conn.execute(subquery_sql(verify_query))
+                return compare_ordered_rows(user_rows, expected_rows), None
+
+            return diff_in_sqlite(conn, user_query, verify_query, column_count, limit=1).fetchone() is None, None
+
+    except Exception as e:
+        print(e)
+        return None, str(e)
+
+def safe_grade_in_sqlite(user_query: str, verify_query: str, column_count: int, order_sensitive: bool, limits=None):
+    """Run grade_in_sqlite with timeout."""
+    limits = limits or DEFAULT_QUERY_LIMITS
+    return execute_with_timeout(
+        grade_in_sqlite, user_query, verify_query, column_count, order_sensitive, limits=limits, timeout=limits["timeout"]
+    )
 
-def evaluate_read_only(user_query: str, verify_query: str, order_sensitive: bool) -> tuple[bool, str]:
+def get_expected_rows(verify_query: str, order_sensitive: bool, task_id=None, limits=None):
+    """
+    Returns (expected_rows, error) for a verify-query, with the rows ready for comparison (see build_expected_rows).
+    Results are served from / stored in the EXPECTED_RESULTS cache when a task_id is given.
+    """
+    if task_id is not None:
+        expected_rows = EXPECTED_RESULTS.get(task_id, verify_query, kind="verify")
+        if expected_rows is not None:
+            return expected_rows, None
+
+    expected_rows, expected_err = safe_run_readonly_rows(
+        verify_query,
+        lambda rows, columns: build_expected_rows(rows, columns, order_sensitive, max_rows=EVAL_ROW_LIMIT),
+        row_limit=None,
+        limits=limits
+    )
+    if expected_err:
+        return None, expected_err
+
+    if task_id is not None:
+        EXPECTED_RESULTS.put(task_id, verify_query, expected_rows, kind="verify")
+    return expected_rows, None
+
+def evaluate_read_only(user_query: str, verify_query: str, order_sensitive: bool, task_id=None, limits=None) -> tuple[bool, str, dict]:
     """
     Executes a read-only user query and compares it against the verification query.
-    Returns (results_match, user_error). If no error occurs, user_error will be None
+    The user's rows are compared straight off the cursor, and a wrong answer's diff report is built in the same pass 
+    (see compare_and_diff_rows). When the expected results are larger than EVAL_ROW_LIMIT, they are compared inside 
+    SQLite instead (see grade_in_sqlite), and only a wrong answer is queried again for its diff report (see diff_in_sqlite_report).
+    Neither result is truncated. If a task_id is given, the expected rows are cached for future submissions of that task.
+    Returns (results_match, user_error, diff). If no error occurs, user_error will be None. diff is None unless the answer is wrong.
     """
-    user_err = None
     try:
-        _, user_rows, user_err = safe_run_readonly(user_query)
+        expected_rows, expected_err = get_expected_rows(verify_query, order_sensitive, task_id, limits)
+        if expected_err:
+            return False, f"Internal error in verification query: {expected_err}", None
+
+        if expected_rows["rows"] is not None:
+            graded, user_err = safe_run_readonly_rows(
+                user_query,
+                lambda rows, columns: compare_and_diff_rows(rows, columns, expected_rows),
+                row_limit=None,
+                limits=limits
+            )
+            if user_err:
+                return False, user_err, None
+            results_match, diff = graded
+            return results_match, None, diff
+
+        results_match, user_err = safe_grade_in_sqlite(
+            user_query, verify_query, expected_rows["column_count"], order_sensitive, limits=limits
+        )
         if user_err:
-            return False, user_err
+            return False, user_err, None
 
-        _, expected_rows, expected_err = safe_run_readonly(verify_query)
-        if expected_err:
-            return False, f"Internal error in verification query: {expected_err}"
+        diff = None
+        if results_match is False:
+            try:
+                timeout = (limits or DEFAULT_QUERY_LIMITS)["timeout"]
+                diff, _ = execute_with_timeout(
+                    diff_in_sqlite_report, user_query, verify_query, expected_rows["columns"], limits=limits, timeout=timeout
+                )
+            except Exception as e:
+                print(e)
+            if diff is not None:
+                mark_order_differs(diff, order_sensitive)
+        return results_match, None, diff
 
-        user_tuples = rows_to_tuples(user_rows)
-        expected_tuples = rows_to_tuples(expected_rows)
+    except Exception as e:
+        return False, str(e), None
 
-        if order_sensitive:
-            results_match = (user_tuples == expected_tuples)
-        else:
-            results_match = (sorted(user_tuples) == sorted(expected_tuples))
+def run_dml_in_sandbox(conn, query: str, verify_query: str, consume, limits=None):
+    """
+    Runs a DML query in a sandbox connection, followed by the verify-query. 
+    Returns consume(rows, columns) for the verify-query rows. If the verify-query fails (e.g. the table was dropped),
+    the error message is passed as a single one column row. Without a verify-query there are no rows or columns.
+    """
+    cur = conn.cursor()
+    with query_limits(conn, limits):
+        cur.execute(query)
+        conn.commit()
+
+        # Safe verification (may fail if table dropped)
+        if not verify_query.strip():
+            return consume([], [])
+        try:
+            cur.execute(verify_query)
+        except sqlite3.OperationalError as e:
+            return consume([(str(e),)], ["error"])
+        return consume(cur, [d[0] for d in cur.description])
 
-        return results_match, None
+def get_expected_dml_rows(correct_query: str, verify_query: str, order_sensitive: bool, task_id=None, limits=None):
+    """
+    Returns the expected verify-query rows of a DML task (ready for comparison), after running the correct-query in its own sandbox.
+    Results are served from / stored in the EXPECTED_RESULTS cache when a task_id is given.
+    """
+    source = (correct_query, verify_query)
+    if task_id is not None:
+        expected_rows = EXPECTED_RESULTS.get(task_id, source, kind="dml")
+        if expected_rows is not None:
+            return expected_rows
 
-    except Exception as e:
-        return False, str(e)
+    expected_conn = SANDBOX_POOL.acquire()
+    try:
+        expected_rows = run_dml_in_sandbox(
+            expected_conn, correct_query, verify_query,
+            lambda rows, columns: build_expected_rows(rows, columns, order_sensitive),
+            limits
+        )
+    finally:
+        expected_conn.close()
 
-def evaluate_dml(user_query: str, correct_query: str, verify_query: str, order_sensitive: bool) -> tuple[bool, str]:
+    if task_id is not None:
+        EXPECTED_RESULTS.put(task_id, source, expected_rows, kind="dml")
+    return expected_rows
+
+def evaluate_dml(user_query: str, correct_query: str, verify_query: str, order_sensitive: bool, task_id=None, limits=None) -> tuple[bool, str, dict]:
     """
     Executes a user DML query in a sandbox DB and compares the result against the correct query.
-    Returns (results_match, user_error). If no error occurs, user_error will be None
+    The expected results are cached per task when a task_id is given, so only the user's sandbox is built per submission.
+    A wrong answer's diff report is built in the same pass over the verify-query rows (see compare_and_diff_rows).
+    The queries run under the query_limits given by limits.
+    Returns (results_match, user_error, diff). If no error occurs, user_error will be None. diff is None unless the answer is wrong.
     """
-    user_rows = []
-    expected_rows = []
     user_err = None
     results_match = False
+    diff = None
 
-    conn, tmpdb = create_sandbox_db(row_factory=True)
+    conn = SANDBOX_POOL.acquire()
     try:
-        cur = conn.cursor()
+        expected_rows = get_expected_dml_rows(correct_query, verify_query, order_sensitive, task_id, limits)
 
-        # Execute user's DML
-        cur.execute(user_query)
-        conn.commit()
+        # Execute user's DML, and compare the verify-query results
+        results_match, diff = run_dml_in_sandbox(
+            conn, user_query, verify_query,
+            lambda rows, columns: compare_and_diff_rows(rows, columns, expected_rows),
+            limits
+        )
 
-        # Safe verification (may fail if table dropped)
-        if verify_query.strip():
-            try:
-                cur.execute(verify_query)
-                user_rows = dict_rows(cur)
-            except sqlite3.OperationalError as e:
-                user_rows = [{"error": str(e)}]
+    except Exception as e:
+        user_err = str(e)
+        results_match = False
+        diff = None
+    finally:
+        conn.close()
 
-        # Run expected query in a separate sandbox
-        expected_conn, expected_tmp = create_sandbox_db(row_factory=True)
-        try:
-            ecur = expected_conn.cursor()
+    return results_match, user_err, diff
+
+def get_table_schema(conn, table):
+    """
+    Returns the columns (PRAGMA table_info rows, as dicts), UNIQUE columns and upper-cased CREATE TABLE sql of a table.
+    The schema holds plain values only, so cached schemas can be passed to evaluation workers.
+    """
+    cur = conn.cursor()
+
+    # Column info
+    cur.execute(f"PRAGMA table_info({table})")
+    columns = [dict(col) for col in cur.fetchall()]
+
+    # Unique constraints
+    cur.execute(f"PRAGMA index_list({table})")
+    indexes = cur.fetchall()
+
+    unique_cols = set()
+    for idx in indexes:
+        idx_name = idx["name"] if isinstance(idx, dict) else idx[1]
+        is_unique = idx["unique"] if isinstance(idx, dict) else idx[2]
+        if is_unique:
+            cur.execute(f"PRAGMA index_info({idx_name})")
+            for col in cur.fetchall():
+                unique_cols.add(col["name"] if isinstance(col, dict) else col[2])
+
+    # Raw SQL (needed for AUTOINCREMENT)
+    cur.execute(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name=?",
+        (table,)
+    )
+    sql_row = cur.fetchone()
+    table_sql = sql_row["sql"] if sql_row else ""
+
+    return {
+        "columns": columns,
+        "unique_cols": frozenset(unique_cols),
+        "sql": table_sql.upper()
+    }
+
+def get_expected_table_schema(correct_query: str, table_name: str, task_id=None, limits=None):
+    """
+    Returns the schema of the table created by a create-tables task's correct-query, or None if the query does not create the table.
+    Schemas are served from / stored in the EXPECTED_RESULTS cache when a task_id is given.
+    """
+    source = (correct_query, table_name)
+    if task_id is not None:
+        expected_schema = EXPECTED_RESULTS.get(task_id, source, kind="schema")
+        if expected_schema is not None:
+            return expected_schema
+
+    expected_conn = SANDBOX_POOL.acquire(row_factory=True)
+    try:
+        ecur = expected_conn.cursor()
+        with query_limits(expected_conn, limits):
             ecur.execute(correct_query)
             expected_conn.commit()
 
-            if verify_query.strip():
-                try:
-                    ecur.execute(verify_query)
-                    expected_rows = dict_rows(ecur)
-                except sqlite3.OperationalError as e:
-                    expected_rows = [{"error": str(e)}]
-        finally:
-            expected_conn.close()
-            os.remove(expected_tmp)
-
-        # Compare results
-        if order_sensitive:
-            results_match = (user_rows == expected_rows)
-        else:
-            results_match = (sorted(user_rows, key=str) == sorted(expected_rows, key=str))
+        ecur.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+            (table_name,)
+        )
+        if not ecur.fetchone():
+            return None
 
-    except Exception as e:
-        user_err = str(e)
-        results_match = False
+        expected_schema = get_table_schema(expected_conn, table_name)
     finally:
-        conn.close()
-        try:
-            os.remove(tmpdb)
-        except:
-            pass
+        expected_conn.close()
 
-    return results_match, user_err
+    if task_id is not None:
+        EXPECTED_RESULTS.put(task_id, source, expected_schema, kind="schema")
+    return expected_schema
 
-def evaluate_created_table(user_query: str, correct_query: str, table_name: str) -> tuple[bool, str]:
+def evaluate_created_table(user_query: str, correct_query: str, table_name: str, task_id=None, limits=None) -> tuple[bool, str]:
     """
     Validates that a table was created exactly as expected:
     - Table existence
     - Column names & order
     - Column data types
     - Constraints (PK, NOT NULL, UNIQUE, DEFAULT, AUTOINCREMENT)
+    The expected schema is cached per task when a task_id is given.
 
     Returns (match: bool, user_error: str | None)
     """
 
-    def get_table_schema(conn, table):
-        cur = conn.cursor()
-
-        # Column info
-        cur.execute(f"PRAGMA table_info({table})")
-        columns = cur.fetchall()
-
-        # Unique constraints
-        cur.execute(f"PRAGMA index_list({table})")
-        indexes = cur.fetchall()
-
-        unique_cols = set()
-        for idx in indexes:
-            idx_name = idx["name"] if isinstance(idx, dict) else idx[1]
-            is_unique = idx["unique"] if isinstance(idx, dict) else idx[2]
-            if is_unique:
-                cur.execute(f"PRAGMA index_info({idx_name})")
-                for col in cur.fetchall():
-                    unique_cols.add(col["name"] if isinstance(col, dict) else col[2])
-
-        # Raw SQL (needed for AUTOINCREMENT)
-        cur.execute(
-            "SELECT sql FROM sqlite_master WHERE type='table' AND name=?",
-            (table,)
-        )
-        sql_row = cur.fetchone()
-        table_sql = sql_row["sql"] if sql_row else ""
-
-        return {
-            "columns": columns,
-            "unique_cols": unique_cols,
-            "sql": table_sql.upper()
-        }
-
     def normalize_type(t):
         """SQLite is flexible with types — normalize common aliases."""
         if not t:
@@ -735,11 +2723,12 @@ def evaluate_created_table(user_query: str, correct_query: str, table_name: str)
 
     user_err = None
 
-    conn, tmpdb = create_sandbox_db(row_factory=True)
+    conn = SANDBOX_POOL.acquire(row_factory=True)
     try:
         cur = conn.cursor()
-        cur.execute(user_query)
-        conn.commit()
+        with query_limits(conn, limits):
+            cur.execute(user_query)
+            conn.commit()
 
         # Check table existence
         cur.execute(
@@ -750,64 +2739,48 @@ def evaluate_created_table(user_query: str, correct_query: str, table_name: str)
             return False, f"Table '{table_name}' was not created."
 
         # Build expected schema
-        expected_conn, expected_tmp = create_sandbox_db(row_factory=True)
-        try:
-            ecur = expected_conn.cursor()
-            ecur.execute(correct_query)
-            expected_conn.commit()
-
-            ecur.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
-                (table_name,)
-            )
-            if not ecur.fetchone():
-                return False, "Expected table definition is invalid."
-
-            user_schema = get_table_schema(conn, table_name)
-            expected_schema = get_table_schema(expected_conn, table_name)
+        expected_schema = get_expected_table_schema(correct_query, table_name, task_id, limits)
+        if expected_schema is None:
+            return False, "Expected table definition is invalid."
 
-            user_cols = user_schema["columns"]
-            expected_cols = expected_schema["columns"]
+        user_schema = get_table_schema(conn, table_name)
 
-            # Column count
-            if len(user_cols) != len(expected_cols):
-                return False, "Incorrect number of columns."
+        user_cols = user_schema["columns"]
+        expected_cols = expected_schema["columns"]
 
-            # Column-by-column comparison
-            for u, e in zip(user_cols, expected_cols):
-                u_name, e_name = u["name"], e["name"]
-                print(u["notnull"])
-                print(e["notnull"])
-                if u_name != e_name:
-                    return False, f"Column '{u_name}' should be '{e_name}'."
+        # Column count
+        if len(user_cols) != len(expected_cols):
+            return False, "Incorrect number of columns."
 
-                if normalize_type(u["type"]) != normalize_type(e["type"]):
-                    return False, f"Incorrect datatype for column '{u_name}'."
+        # Column-by-column comparison
+        for u, e in zip(user_cols, expected_cols):
+            u_name, e_name = u["name"], e["name"]
+            if u_name != e_name:
+                return False, f"Column '{u_name}' should be '{e_name}'."
 
-                if u["notnull"] != e["notnull"]:
-                    return False, f"NOT NULL constraint mismatch on '{u_name}'."
+            if normalize_type(u["type"]) != normalize_type(e["type"]):
+                return False, f"Incorrect datatype for column '{u_name}'."
 
-                if bool(u["pk"]) != bool(e["pk"]):
-                    return False, f"PRIMARY KEY constraint mismatch on '{u_name}'."
+            if u["notnull"] != e["notnull"]:
+                return False, f"NOT NULL constraint mismatch on '{u_name}'."
 
-                if u["dflt_value"] != e["dflt_value"]:
-                    return False, f"DEFAULT value mismatch on '{u_name}'."
+            if bool(u["pk"]) != bool(e["pk"]):
+                return False, f"PRIMARY KEY constraint mismatch on '{u_name}'."
 
-            # UNIQUE constraints
-            if user_schema["unique_cols"] != expected_schema["unique_cols"]:
-                return False, "UNIQUE constraint mismatch."
+            if u["dflt_value"] != e["dflt_value"]:
+                return False, f"DEFAULT value mismatch on '{u_name}'."
 
-            # AUTOINCREMENT (must inspect SQL)
-            if ("AUTOINCREMENT" in expected_schema["sql"]) != (
-                "AUTOINCREMENT" in user_schema["sql"]
-            ):
-                return False, "AUTOINCREMENT constraint mismatch."
+        # UNIQUE constraints
+        if user_schema["unique_cols"] != expected_schema["unique_cols"]:
+            return False, "UNIQUE constraint mismatch."
 
-            return True, None
+        # AUTOINCREMENT (must inspect SQL)
+        if ("AUTOINCREMENT" in expected_schema["sql"]) != (
+            "AUTOINCREMENT" in user_schema["sql"]
+        ):
+            return False, "AUTOINCREMENT constraint mismatch."
 
-        finally:
-            expected_conn.close()
-            os.remove(expected_tmp)
+        return True, None
 
     except Exception as e:
         user_err = str(e)
@@ -815,10 +2788,311 @@ def evaluate_created_table(user_query: str, correct_query: str, table_name: str)
 
     finally:
         conn.close()
+
+# ------------- Diff reports -------------
+def json_row(values) -> list:
+    """
+    Converts a row into a JSON friendly list, with values shown as in previews (NULLs are sent as "NULL", BLOBs as hex).
+    """
+    return [
+        "NULL" if value is None else bytes(value).hex() if isinstance(value, (bytes, bytearray, memoryview)) else value
+        for value in values
+    ]
+
+def empty_diff_report(columns: list, expected_columns: list) -> dict:
+    """
+    Returns a diff report with no row differences. The columns entry lists both sets of column names, only if they differ
+    in number or name (names are compared case-insensitively, although results are compared by position).
+    """
+    column_diff = None
+    if [c.lower() for c in columns] != [c.lower() for c in expected_columns]:
+        column_diff = {"expected": expected_columns, "actual": columns}
+
+    return {
+        "columns": column_diff,
+        "missing-rows": [],
+        "missing-count": 0,
+        "extra-rows": [],
+        "extra-count": 0
+    }
+
+def diff_rows(rows, columns: list, expected: dict, limit: int = DIFF_ROW_LIMIT) -> dict:
+    """
+    Builds the diff report of result rows against expected rows from build_expected_rows:
+        {"columns": ..., "missing-rows": [...], "missing-count": int, "extra-rows": [...], "extra-count": int}
+    Rows are matched as a multiset: the expected rows (already in memory) are counted by their normalized tuples, the 
+    result rows are streamed once (unmatched rows are extra), and the expected rows are walked again to list the ones 
+    left unmatched (missing). Rows are compared by equality, never by hash alone, so colliding hashes can't hide a difference.
+    """
+    report = empty_diff_report(columns, expected["columns"])
+    if len(columns) != expected["column_count"]:
+        return report
+
+    def expected_rows():
+        if expected["order_sensitive"]:
+            return iter(expected["rows"])
+        return expected["rows"].elements()
+
+    remaining = collections.Counter(expected_rows())
+
+    for row in rows:
+        key = normalize_row(row)
+        if remaining[key] > 0:
+            remaining[key] -= 1
+            continue
+
+        report["extra-count"] += 1
+        if len(report["extra-rows"]) < limit:
+            report["extra-rows"].append(json_row(key))
+
+    report["missing-count"] = sum(remaining.values())
+    for row in expected_rows():
+        if len(report["missing-rows"]) >= limit:
+            break
+        if remaining[row] > 0:
+            remaining[row] -= 1
+            report["missing-rows"].append(json_row(row))
+
+    return report
+
+def diff_in_sqlite_report(user_query: str, verify_query: str, expected_columns: list, limit: int = DIFF_ROW_LIMIT, limits=None):
+    """
+    Builds the diff report (see diff_rows) for results too large to keep in Python, from the mismatching groups
+    computed by diff_in_sqlite. Returns (report, error_msg).
+    """
+    try:
+        with READONLY_POOL.connection() as conn, query_limits(conn, limits):
+            conn.row_factory = None
+            columns = query_columns(conn, user_query)
+            report = empty_diff_report(columns, expected_columns)
+            if len(columns) != len(expected_columns):
+                return report, None
+
+            for row in diff_in_sqlite(conn, user_query, verify_query, len(columns)):
+                values, user_count, expected_count = row[:-2], row[-2], row[-1]
+                kind = "extra" if user_count > expected_count else "missing"
+                difference = abs(user_count - expected_count)
+
+                report[f"{kind}-count"] += difference
+                listed = report[f"{kind}-rows"]
+                listed.extend([json_row(values)] * min(difference, limit - len(listed)))
+
+            return report, None
+
+    except Exception as e:
+        print(e)
+        return None, str(e)
+
+def mark_order_differs(report: dict, order_sensitive: bool) -> dict:
+    """
+    Sets a diff report's order-differs flag: an order sensitive result has the right rows, but in the wrong order.
+    """
+    report["order-differs"] = (
+        order_sensitive and report["columns"] is None and not report["missing-count"] and not report["extra-count"]
+    )
+    return report
+
+def compare_and_diff_rows(rows, columns: list, expected: dict, limit: int = DIFF_ROW_LIMIT):
+    """
+    Compares result rows against expected rows (see compare_rows), and for a wrong answer builds the diff report 
+    (see diff_rows) in the same pass, so the query is never run twice: the rows read by the comparison (at most one 
+    more than expected) are kept, and replayed ahead of the rest of rows when the comparison fails.
+    Returns (results_match, diff), where diff is None if the rows match.
+    """
+    rows = iter(rows)
+    consumed = []
+
+    def tracked_rows():
+        for row in rows:
+            consumed.append(row)
+            yield row
+
+    if compare_rows(tracked_rows(), columns, expected):
+        return True, None
+    report = diff_rows(itertools.chain(consumed, rows), columns, expected, limit)
+    return False, mark_order_differs(report, expected["order_sensitive"])
+
+def evaluate_task(task_record: dict, user_query: str) -> tuple[bool, str, dict]:
+    """
+    Evaluates a query against a task (a record from the task index), using the evaluation method the task's flags call for.
+    Returns (results_match, user_error, diff). If no error occurs, user_error will be None.
+    diff is the bounded diff report of a wrong answer (see diff_rows), and None otherwise (table definition tasks have none).
+    """
+    task = task_record["task"]
+    task_id = task.get("task-id")
+    verify_query = task.get("verify-query")
+    correct_query = task.get("correct-query")
+    is_dml_allowed = task_record["allow-dml"]
+    is_table_definition = task_record["create-tables"]
+    order_sensitive = task_record["order-sensitive"]
+    limits = task_record["limits"]
+
+    if not is_dml_allowed and not is_table_definition:
+        # Standard read only test
+        return evaluate_read_only(user_query, verify_query, order_sensitive, task_id=task_id, limits=limits)
+    elif is_dml_allowed and not is_table_definition:
+        # DML Test
+        return evaluate_dml(user_query, correct_query, verify_query, order_sensitive, task_id=task_id, limits=limits)
+    else:
+        # Table definition test
+        expected_table_name = task.get("expected-table-name")
+        return (*evaluate_created_table(user_query, verify_query, expected_table_name, task_id=task_id, limits=limits), None)
+
+def get_verdict(task_record: dict, user_query: str):
+    """
+    Grades a submission (see evaluate_task), on the EVAL_POOL worker processes when they are running.
+    Verdicts are served from / stored in the VERDICT_CACHE. Submissions that errored are not cached, as an error
+    can be caused by the server's load (e.g. a timeout), and are cheap to evaluate otherwise.
+    Returns (results_match, user_error, diff).
+    """
+    key = VERDICT_CACHE.key(task_record["task"].get("task-id"), user_query)
+    verdict = VERDICT_CACHE.get(key)
+    if verdict is not None:
+        return verdict
+
+    results_match, user_error, diff = EVAL_POOL.grade(task_record, user_query)
+
+    if results_match is not None and not user_error:
+        VERDICT_CACHE.put(key, (results_match, user_error, diff))
+    return results_match, user_error, diff
+
+# ------------- Evaluation worker processes -------------
+def peak_memory_usage():
+    """
+    Returns the peak memory (bytes) used by this process, or None where the resource module is unavailable (Windows).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def init_eval_worker(seed_image: bytes, db_version: int, db_path: str, expected_results: dict):
+    """
+    Initializer of an evaluation worker process. Loads the worker's own copy of the database from the serialized seed image, 
+    once per worker, into a shared in-memory DB (db_path) the worker's READONLY_POOL and sandboxes are then built from.
+    The worker's EXPECTED_RESULTS starts with the parent's entries (see ExpectedResultCache.snapshot), so a warm up done
+    in the parent also covers the workers.
+    """
+    global DB_PATH, DB_INIT_CONN, DB_VERSION, SEED_IMAGE, _db_initialized
+    DB_PATH = db_path
+    DB_INIT_CONN = sqlite3.connect(DB_PATH, uri=True, check_same_thread=False)
+
+    image_conn = sqlite3.connect(":memory:")
+    image_conn.deserialize(seed_image)
+    image_conn.backup(DB_INIT_CONN)
+    image_conn.close()
+
+    DB_VERSION = db_version
+    SEED_IMAGE = (db_version, seed_image)
+    _db_initialized = True
+    EXPECTED_RESULTS.load(expected_results)
+
+def grade_in_worker(task_record: dict, user_query: str):
+    """
+    Grades a submission inside an evaluation worker. Returns (results_match, user_error, diff, peak memory of the worker).
+    """
+    return (*evaluate_task(task_record, user_query), peak_memory_usage())
+
+class EvaluationPool:
+    """
+    Pool of worker processes that grade submissions (see evaluate_task), so grading runs on every core instead of 
+    being serialized by the GIL, and a runaway evaluation can't starve the request threads.
+        - Each worker loads its own copy of the database from the seed image once, when it starts (see init_eval_worker), 
+          and keeps its own EXPECTED_RESULTS cache, starting from a copy of the parent's (filled by --warm-up)
+        - Workers are replaced after max_tasks evaluations. A worker reporting a peak memory above max_memory gets the 
+          whole pool replaced (evaluations already running on the old pool finish first)
+        - Results come back as a small tuple of plain values, and the diff report is bounded by DIFF_ROW_LIMIT rows
+    Until start() is called (--eval-processes), submissions are graded in the request thread.
+    """
+
+    def __init__(self, max_tasks=EVAL_MAX_TASKS_PER_WORKER, max_memory=EVAL_WORKER_MAX_MEMORY):
+        self.processes = 0
+        self.max_tasks = max_tasks
+        self.max_memory = max_memory
+        self._executor = None
+        self._version = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.recycled = 0
+        self.timeouts = 0
+
+    def start(self, processes: int):
+        """
+        Starts the worker processes, with the database as it currently is (DB_VERSION).
+        """
+        self.processes = processes
+        with self._lock:
+            self._executor = self._new_executor()
+        atexit.register(self.shutdown)
+
+    def _new_executor(self):
+        self._version = DB_VERSION
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_eval_worker,
+            initargs=(get_seed_image(), DB_VERSION, DB_PATH, EXPECTED_RESULTS.snapshot()),
+            max_tasks_per_child=self.max_tasks
+        )
+
+    def recycle(self, executor):
+        """
+        Replaces the workers with new ones, unless executor was already replaced (e.g. by another request thread).
+        """
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = self._new_executor()
+            self.recycled += 1
+        executor.shutdown(wait=False)
+
+    def grade(self, task_record: dict, user_query: str):
+        """
+        Grades a submission on a worker process (or in this thread if the pool was not started).
+        Returns (results_match, user_error, diff).
+        """
+        executor = self._executor
+        if executor is None:
+            return evaluate_task(task_record, user_query)
+        if self._version != DB_VERSION:
+            self.recycle(executor)
+            return self.grade(task_record, user_query)
+        with self._lock:
+            self.submitted += 1
+
+        # The expected results, the user's query and the diff each run under the task's time limit
+        timeout = task_record["limits"]["timeout"]
         try:
-            os.remove(tmpdb)
-        except:
-            pass
+            future = executor.submit(grade_in_worker, task_record, user_query)
+            results_match, user_error, diff, peak_memory = future.result(timeout=3 * timeout)
+        except concurrent.futures.TimeoutError:
+            self.timeouts += 1
+            return False, f"Query exceeded {timeout} seconds limit", None
+        except concurrent.futures.process.BrokenProcessPool:
+            self.recycle(executor)
+            return None, "The evaluation worker stopped unexpectedly, please try again", None
+
+        if self.max_memory and peak_memory and peak_memory > self.max_memory:
+            self.recycle(executor)
+        return results_match, user_error, diff
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "processes": self.processes if self._executor is not None else 0,
+            "max_tasks": self.max_tasks,
+            "max_memory": self.max_memory,
+            "submitted": self.submitted,
+            "recycled": self.recycled,
+            "timeouts": self.timeouts
+        }
+
+EVAL_POOL = EvaluationPool()
 
 # -------------------------------------
 # Endpoints
@@ -828,19 +3102,14 @@ def evaluate_created_table(user_query: str, correct_query: str, table_name: str)
 def get_all_lessons():
     """
     Returns basic features about each lesson in the LESSON_LIST.
-    Title, subtitle, order and completed are the fields returned
+    Title, subtitle, order, difficulty and completed are the fields returned.
+    Served from the prebuilt LESSON_CATALOG summary, only the completed flag is computed per request.
     """
+    LESSON_CATALOG.refresh()
+    completed_lessons, _ = current_session().completed()
     results = {}
-    for lesson_id in LESSON_LIST:
-        lesson, _ = load_lesson(lesson_id)
-        difficulty = get_lesson_difficulty(lesson_id)
-        results[lesson_id] = {
-            "title": lesson.get("title"),
-            "subtitle": lesson.get("subtitle"),
-            "order": lesson.get("lesson-order"),
-            "completed": lesson_id in COMPLETED_LESSONS,
-            "difficulty": difficulty
-        }
+    for lesson_id, summary in LESSON_CATALOG.summary.items():
+        results[lesson_id] = {**summary, "completed": lesson_id in completed_lessons}
 
     return jsonify(results)
 
@@ -848,21 +3117,24 @@ def get_all_lessons():
 def get_lesson(lesson_id: str):
     """
     Returns lesson json details from the lesson.json file. 
-    Injects a completed field in the lesson, and tasks if they are in the COMPLETED_LESSONS or COMPLETED_TASKS list.
+    Injects a completed field in the lesson, and tasks if they have been completed by the user (see current_session).
     """
     lesson, _ = load_lesson(lesson_id)
+    completed_lessons, completed_tasks = current_session().completed()
 
-    exercise_tasks = lesson.get("exercise-tasks")
-    for task in exercise_tasks:
-        task["completed"] = task.get("task-id") in COMPLETED_TASKS
+    # Copy the tasks, the cached lesson is shared between requests
+    exercise_tasks = [
+        {**task, "completed": task.get("task-id") in completed_tasks}
+        for task in lesson.get("exercise-tasks")
+    ]
 
     return jsonify({
         "id": lesson_id,
         "title": lesson.get("title"),
         "subtitle": lesson.get("subtitle"),
         "database-tables": lesson.get("database-tables"),
-        "exercise-tasks": lesson.get("exercise-tasks"),
-        "completed": lesson_id in COMPLETED_LESSONS
+        "exercise-tasks": exercise_tasks,
+        "completed": lesson_id in completed_lessons
     })
 
 @app.get("/lessons/next_lesson/<lesson_id>/<direction>")
@@ -908,32 +3180,30 @@ def get_lesson_markdown(lesson_id: str):
 def complete_lesson(lesson_id: str):
     """
     Attempts to complete a lesson
-    Checks that all the lesson's tasks were completed before adding to COMPLETED_LESSONS set
+    Checks that all the lesson's tasks were completed before marking the lesson as completed
     """
 
     lesson, _ = load_lesson(lesson_id)
     lesson_tasks = lesson.get("exercise-tasks") or []
-    for task in lesson_tasks:
-        key = task.get('task-id')
-        if key not in COMPLETED_TASKS:
-            return {"status": "error", "message":"Failure: not all tasks have been completed for this lesson"}, 400
+    if not current_session().complete_lesson(lesson_id, [task.get('task-id') for task in lesson_tasks]):
+        return {"status": "error", "message":"Failure: not all tasks have been completed for this lesson"}, 400
 
-    COMPLETED_LESSONS.add(lesson_id)
     return {"status": "success"}, 200
 
 @app.post("/lessons/preview/<lesson_id>/<float:task_id>")
 def preview_query(lesson_id: str, task_id: float):
     """
-    Preview endpoint for debounced typing. Body JSON: { "sql": "SELECT ..."}
-    Returns rows & columns on success, or 400 with error.
+    Preview endpoint for debounced typing. Body JSON: { "query": "SELECT ...", "editorId": "...", "seq": 1 }
+    Returns rows & columns on success (streamed, column-oriented: see stream_readonly_query), or 400 with error.
+    Runs at preview priority, and returns 429 if the QUERY_SCHEDULER sheds it.
+    The optional editorId and seq (increasing per editor) let a newer preview from the same editor cancel an older one 
+    that is still running (see PreviewTracker). The older preview's stream ends early, and previews older than the latest return 409.
     """
-    lesson,_ = load_lesson(lesson_id)
-    for task in lesson.get("exercise-tasks"):
-        if task.get("id") == task_id:
-            if not task.get("preview-allowed"):
-                jsonify({"error": "Preview now allowed for this task"}), 403
-            else: 
-                break
+    task_record = get_task(lesson_id, task_id)
+    if task_record is None:
+        return jsonify({"error": f"Invalid task id {task_id}"}), 404
+    if not task_record["preview-allowed"]:
+        return jsonify({"error": "Preview not allowed for this task"}), 403
 
     data = request.get_json(silent=True) or {}
     sql = data.get("query", "")
@@ -945,11 +3215,152 @@ def preview_query(lesson_id: str, task_id: float):
     if not ok:
         return jsonify({"error": "Not Allowed", "message": msg})
 
-    columns, rows, err = safe_run_readonly(sql, row_limit=PREVIEW_ROW_LIMIT)
+    editor_id, seq = data.get("editorId"), data.get("seq")
+    cancel = None
+    if isinstance(editor_id, str) and 0 < len(editor_id) <= 64 and isinstance(seq, int):
+        cancel = PREVIEW_TRACKER.begin(g.session_id, editor_id, seq)
+        if cancel is None:
+            return jsonify({"error": "Superseded", "message": "A newer preview was already received"}), 409
+
+    client_id = g.session_id
+    def finish():
+        if cancel is not None:
+            PREVIEW_TRACKER.finish(client_id, editor_id, seq)
+
+    try:
+        response, err = schedule_stream(
+            PRIORITY_PREVIEW, sql, row_limit=PREVIEW_ROW_LIMIT, limits=task_record["limits"], cache=PREVIEW_CACHE, cancel=cancel,
+            supersede_key=editor_id if cancel is not None else None
+        )
+    except QueryRejected:
+        finish()
+        raise
     if err:
+        finish()
         return jsonify({"error": "Invalid SQL query", "message": err})
 
-    return jsonify({"results":{"columns": columns, "rows": rows}}), 200
+    response.call_on_close(finish)
+    return response, 200
+
+@app.post("/lessons/check/<lesson_id>/<float:task_id>")
+def check_submission(lesson_id: str, task_id: float):
+    """
+    Compile-only check for the editor, called on every pause in typing at a fraction of the cost of a preview. Body JSON: { "query": "SELECT ..." }
+    The query is validated like a preview (is_select_only), then compiled without being run (see check_query), in a 
+    QUERY_SCHEDULER slot at PRIORITY_PREVIEW. A check waiting for its slot is superseded (409) by the same editor's next 
+    check (optional "editorId" in the body), and is shed (429) like a preview when the server is busy.
+    Returns 200 {"valid": true, "columns": [{"name", "type"}], "plan": [{"id", "parent", "detail"}]} 
+    or 200 {"valid": false, "error": ..., "message": ...} with the syntax (or validation) error.
+    """
+    task_record = get_task(lesson_id, task_id)
+    if task_record is None:
+        return jsonify({"error": f"Invalid task id {task_id}"}), 404
+    if not task_record["preview-allowed"]:
+        return jsonify({"error": "Preview not allowed for this task"}), 403
+
+    data = request.get_json(silent=True)
+    if not data or "query" not in data:
+        return jsonify({"error": "Missing 'query' in request body."}), 400
+
+    user_query = strip_sql_comments(data["query"])
+    ok, msg = is_select_only(user_query)
+    if not ok:
+        return jsonify({"valid": False, "error": "Not Allowed", "message": msg}), 200
+
+    editor_id = data.get("editorId")
+    supersede_key = ("check", editor_id) if isinstance(editor_id, str) and 0 < len(editor_id) <= 64 else None
+    with QUERY_SCHEDULER.slot(PRIORITY_PREVIEW, g.session_id, supersede_key):
+        result, err = check_query(user_query, limits=task_record["limits"])
+    if err:
+        return jsonify({"valid": False, "error": "Invalid SQL query", "message": err}), 200
+
+    return jsonify({"valid": True, **result}), 200
+
+@app.get("/lessons/live/<lesson_id>")
+def open_live_preview(lesson_id: str):
+    """
+    Opens the live-preview channel of an editor (query string: editorId), as a Server-Sent Events stream.
+    Query updates are sent with POST /lessons/live/<lesson_id>/<task_id>, and their results come back on this stream in 
+    row batches (see live_preview_events). The stream sends a keep-alive comment every LIVE_PING_INTERVAL seconds, and 
+    ends with an idle event after LIVE_IDLE_TIMEOUT seconds without updates (the editor reopens it when needed).
+    If LIVE_CHANNELS is full (or disabled, as in --serve mode by default), the stream is just an unavailable event, 
+    and the editor keeps using POST /lessons/preview.
+    """
+    load_lesson(lesson_id)
+    editor_id = request.args.get("editorId", "")
+    if not 0 < len(editor_id) <= 64:
+        return jsonify({"error": "Missing 'editorId'"}), 400
+
+    client_id = g.session_id
+    channel = LIVE_CHANNELS.open(client_id, editor_id)
+    if channel is None:
+        # An EventSource can't read error statuses, so the refusal is sent as an event
+        response = Response(sse_event("unavailable", {"message": "No live preview channel available"}), mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    def generate():
+        try:
+            yield sse_event("ready", {"editorId": editor_id})
+            last_update = time.monotonic()
+            while not channel.closed:
+                update = channel.next(LIVE_PING_INTERVAL)
+                if update is None:
+                    if time.monotonic() - last_update > LIVE_IDLE_TIMEOUT:
+                        yield sse_event("idle", {})
+                        return
+                    yield ": ping\n\n"
+                    continue
+                last_update = time.monotonic()
+                yield from live_preview_events(client_id, editor_id, update)
+        finally:
+            LIVE_CHANNELS.remove(client_id, editor_id, channel)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.post("/lessons/live/<lesson_id>/<float:task_id>")
+def update_live_preview(lesson_id: str, task_id: float):
+    """
+    Sends a query update to an editor's live-preview channel. Body JSON: { "editorId": "...", "seq": 1, "query": "SELECT ..." }
+    or { "editorId": "...", "seq": 1, "cancel": true } to cancel the running preview.
+    The update supersedes the editor's previous preview (see PreviewTracker), and its results are streamed on the channel.
+    Returns 202 once queued, 404 if the editor has no open channel (the editor then falls back to POST /lessons/preview),
+    409 if a newer update was already received, or 400/403 if the query can't be previewed.
+    """
+    task_record = get_task(lesson_id, task_id)
+    if task_record is None:
+        return jsonify({"error": f"Invalid task id {task_id}"}), 404
+    if not task_record["preview-allowed"]:
+        return jsonify({"error": "Preview not allowed for this task"}), 403
+
+    data = request.get_json(silent=True) or {}
+    editor_id, seq = data.get("editorId"), data.get("seq")
+    if not isinstance(editor_id, str) or not isinstance(seq, int):
+        return jsonify({"error": "Missing 'editorId' or 'seq' in request body."}), 400
+
+    channel = LIVE_CHANNELS.get(g.session_id, editor_id)
+    if channel is None:
+        return jsonify({"error": "No live preview channel open"}), 404
+
+    query = data.get("query", "")
+    if not data.get("cancel"):
+        ok, msg = is_select_only(strip_sql_comments(query))
+        if not ok:
+            return jsonify({"error": "Not Allowed", "message": msg}), 400
+
+    cancel = PREVIEW_TRACKER.begin(g.session_id, editor_id, seq)
+    if cancel is None:
+        return jsonify({"error": "Superseded", "message": "A newer preview was already received"}), 409
+
+    if data.get("cancel"):
+        PREVIEW_TRACKER.finish(g.session_id, editor_id, seq)
+        channel.push(None)
+    else:
+        channel.push({"seq": seq, "query": query, "limits": task_record["limits"], "cancel": cancel})
+    return jsonify({"queued": seq}), 202
 
 @app.post("/lessons/evaluate/<lesson_id>/<float:task_id>")
 def evaluate_submission(lesson_id: str, task_id: float):
@@ -959,6 +3370,9 @@ def evaluate_submission(lesson_id: str, task_id: float):
     For DML and table definition tasks, the correct-query is run (e.g. the CREATE TABLE query), and then the verify-query is ran to ensure
     the final states of the correct query are the same as the user query.
     Returns the lesson-id, task-id, userError (is "" if no errors), and results-match, which is True if the user is correct, False otherwise. 
+    Wrong answers (without an error) also get a diff, with the first DIFF_ROW_LIMIT missing and extra rows (see compare_and_diff_rows).
+    Repeated submissions of the same query are answered from the VERDICT_CACHE (see get_verdict).
+    Runs at the highest QUERY_SCHEDULER priority.
     """
 
     data = request.get_json(silent=True)
@@ -967,52 +3381,32 @@ def evaluate_submission(lesson_id: str, task_id: float):
 
     user_query = strip_sql_comments(data["query"])
 
-    # Load lesson + task
-    lesson, _ = load_lesson(lesson_id)
-    tasks = lesson.get("exercise-tasks") or []
-
-    if task_id not in TASKS_LIST:
+    # Load task
+    task_record = get_task(lesson_id, task_id)
+    if task_record is None:
         return jsonify({"error": f"Invalid task id {task_id}"}), 400
 
-    task = next((t for t in tasks if t["task-id"] == task_id), None)
-    if task is None:
-        return jsonify({"error": f"Invalid task id {task_id}"}), 400
-
-    verify_query = task.get("verify-query")
-    correct_query = task.get("correct-query")
-    is_dml_allowed = bool(task.get("allow-dml"))
-    is_table_definition = bool(task.get("create-tables"))
-    order_sensitive = bool(task.get("order-sensitive"))
-
-    results_match = None
-    user_error = None
-
-    if not is_dml_allowed and not is_table_definition:
-        # Standard read only test
-        results_match, user_error = evaluate_read_only(user_query, verify_query, order_sensitive)
-    elif is_dml_allowed and not is_table_definition:
-        # DML Test
-        results_match, user_error = evaluate_dml(user_query, correct_query, verify_query, order_sensitive)
-    else:
-        # Table definition test
-        expected_table_name = task.get("expected-table-name")
-        results_match, user_error = evaluate_created_table(user_query, verify_query, expected_table_name)
+    with QUERY_SCHEDULER.slot(PRIORITY_EVALUATE, g.session_id):
+        results_match, user_error, diff = get_verdict(task_record, user_query)
         
     if results_match is None: 
         return jsonify({"error": f"Internal server error: evaluate methods returned Null outcomes"}), 500
     
     if results_match and not user_error: 
-        # Submission is valid, update COMPLETED_TASKS list 
-        COMPLETED_TASKS.add(task_id)
+        # Submission is valid, mark the task as completed
+        current_session().complete_task(task_id)
 
-    response = {
+    response = replace_nulls({
         "lessonId": lesson_id,
         "taskNumber": task_id,
         "userError": user_error,
         "resultsMatch": results_match
-    }
+    })
+    if not results_match and not user_error:
+        # Added after replace_nulls, the diff rows show NULLs as previews do (see json_row)
+        response["diff"] = diff
 
-    return jsonify(replace_nulls(response)), 200
+    return jsonify(response), 200
 
 @app.get("/lessons/answer/<lesson_id>/<float:task_id>")
 def get_task_answer(lesson_id: str, task_id: float):
@@ -1021,34 +3415,26 @@ def get_task_answer(lesson_id: str, task_id: float):
     Will raise a 403 (forbidden error) if the timer is active
     Will raise a 404 (not found error) if the task number is not valid
     """
-    if task_id not in TASKS_LIST:
+    task_record = get_task(lesson_id, task_id)
+    if task_record is None:
         return jsonify({"error": f"Invalid task number: {task_id}"}), 404
-    if CLOCK_START_TIME:
+    if current_session().clock_start_time():
         # Countdown timer is active - answers not allowed 
         return jsonify({"error": "Cannot fetch answers when timer is active"}), 403
 
     # Valid state, return answer
-    lesson, _ = load_lesson(lesson_id)
-    tasks = lesson.get("exercise-tasks")
-    for task in tasks:
-        if task.get("task-id") == task_id:
-            return jsonify({"answer": f"{task.get("correct-query")}", 
-                "chatgpt-prompt": f"{task.get("chatgpt-prompt")}"
-            }), 200
-
-    return jsonify({"error": f"unable to fetch an answer for task ({task_id})"}), 404
+    task = task_record["task"]
+    return jsonify({"answer": f"{task.get("correct-query")}", 
+        "chatgpt-prompt": f"{task.get("chatgpt-prompt")}"
+    }), 200
 
 # ------------- Session and timer logic -------------
 @app.get("/reset_session")
 def reset_session():
     """
-    Clears all completed tasks, lessons, and clock times.
+    Clears the user's completed tasks, lessons and clock times.
     """
-    global CLOCK_START_TIME, PREVIOUS_COMPLETION_TIMES
-    COMPLETED_LESSONS.clear()
-    COMPLETED_TASKS.clear()
-    CLOCK_START_TIME = None
-    PREVIOUS_COMPLETION_TIMES = []
+    current_session().reset()
     run_init_sql()
     return {"status": "reset"}, 200
 
@@ -1057,40 +3443,28 @@ def start_timer():
     """
     Clears all completed lessons and tasks, and resets the clock timer.
     """
-    global CLOCK_START_TIME
-    global COMPLETED_LESSONS
-    global COMPLETED_TASKS
-
-    CLOCK_START_TIME = datetime.now()
-    COMPLETED_LESSONS = set()
-    COMPLETED_TASKS = set()
-    return {"started": CLOCK_START_TIME.isoformat()}, 200  
+    start_time = current_session().start_timer()
+    return {"started": start_time.isoformat()}, 200  
 
 @app.get("/timer/cancel_attempt")
 def cancel_timer():
     """
-    Cancels the current running clock by setting CLOCK_START_TIME to None.
+    Cancels the current running clock.
     """
-    global CLOCK_START_TIME
-    CLOCK_START_TIME = None
+    current_session().cancel_timer()
     return {"message": "timer cancelled"}, 200  
 
 @app.get("/timer/submit")
 def submit_time():
     """
-    Checks if all tasks and lessons are complete. If they are, save completion time to PREVIOUS_COMPLETION_TIMES
+    Checks if all tasks and lessons are complete. If they are, save the completion time to the previous completion times
     If there are outstanding tasks/lessons, a 400 error is raised.
     """
-    global CLOCK_START_TIME
-    if set(LESSON_LIST) == COMPLETED_LESSONS:
-        # User has completed all lessons. Record the runtime if the clock was started
-        if CLOCK_START_TIME:
-            PREVIOUS_COMPLETION_TIMES.append(datetime.now() - CLOCK_START_TIME)
-        COMPLETED_LESSONS.clear()
-        CLOCK_START_TIME = None
+    submitted, missing_lessons = current_session().submit_time(LESSON_LIST)
+    if submitted:
+        # User has completed all lessons, the runtime was recorded if the clock was started
         return {"message": "timer reset"}, 200
     else:
-        missing_lessons = list(set(LESSON_LIST) - set(COMPLETED_LESSONS))
         return {
             "message": "invalid submission, incomplete lessons",
             "outstanding_lessons": missing_lessons
@@ -1101,20 +3475,21 @@ def get_timer():
     """
     Gets the current status of the timer.
     """
-    if CLOCK_START_TIME:
-        return {"timer_status": "active", "start_time": CLOCK_START_TIME.isoformat()}, 200
+    start_time = current_session().clock_start_time()
+    if start_time:
+        return {"timer_status": "active", "start_time": start_time.isoformat()}, 200
     else:
         return {"timer_status": "inactive", "start_time": None}, 200
 
 @app.get("/timer/attempts")
 def get_timer_attempts():
-    if len(PREVIOUS_COMPLETION_TIMES) > 0:
-        PREVIOUS_COMPLETION_TIMES.sort()
-        best = PREVIOUS_COMPLETION_TIMES[0]
-        last = PREVIOUS_COMPLETION_TIMES[-1]
+    completion_times = current_session().completion_times()
+    if len(completion_times) > 0:
+        best = completion_times[0]
+        last = completion_times[-1]
 
         return {
-            "number_of_attempts": len(PREVIOUS_COMPLETION_TIMES),
+            "number_of_attempts": len(completion_times),
             "best_attempt": format_timedelta(best),
             "last_attempt": format_timedelta(last),
         }
@@ -1134,9 +3509,9 @@ def get_db_rows(table_name: str):
     tmp_query = f"SELECT * FROM {table_name}"
     ok, _ = is_select_only(tmp_query)
     if ok: 
-        columns, rows, err = safe_run_readonly(tmp_query, row_limit=PREVIEW_ROW_LIMIT)
+        response, err = schedule_stream(PRIORITY_TABLE, tmp_query, row_limit=PREVIEW_ROW_LIMIT, cache=PREVIEW_CACHE)
         if not err:
-            return jsonify({"results":{"columns": columns, "rows": rows}}), 200
+            return response, 200
     return jsonify({"error": "Failed to fetch the database table"}), 404
 
 @app.get("/tables/meta/<table_name>")
@@ -1147,6 +3522,26 @@ def get_table_metadata(table_name: str):
     column_names = get_db_table_columns(table_name)
     return {"name": table_name, "columns": column_names} 
 
+# ------------- Diagnostics -------------
+@app.get("/metrics")
+def get_metrics():
+    """
+    Returns usage statistics for the connection pools, result caches, progress store, evaluation workers, query scheduler, live-preview channels and column type probe.
+    """
+    return {
+        "connection_pool": READONLY_POOL.stats(),
+        "sandbox_pool": SANDBOX_POOL.stats(),
+        "expected_results": EXPECTED_RESULTS.stats(),
+        "preview_cache": PREVIEW_CACHE.stats(),
+        "verdict_cache": VERDICT_CACHE.stats(),
+        "progress_store": PROGRESS_STORE.stats(),
+        "eval_pool": EVAL_POOL.stats(),
+        "scheduler": QUERY_SCHEDULER.stats(),
+        "previews": PREVIEW_TRACKER.stats(),
+        "live_channels": LIVE_CHANNELS.stats(),
+        "column_type_probe": COLUMN_TYPE_PROBE.stats()
+    }, 200
+
 # -------------------------------------
 # Routes
 # -------------------------------------
@@ -1165,9 +3560,33 @@ if __name__ == "__main__":
     If there is no instance running, run full startup proccess.
     
     """
-    if check_if_running():
+    multiprocessing.freeze_support()  # evaluation workers of the PyInstaller executable start by re-running it
+    parser = argparse.ArgumentParser(description="SQL Training App")
+    parser.add_argument("--warm-up", action="store_true", help="Precompute and self-check every task's expected results at startup")
+    parser.add_argument("--strict-warm-up", action="store_true", help="Like --warm-up, but exit if any task fails its self-check")
+    parser.add_argument("--warm-up-workers", type=int, default=WARM_UP_WORKERS, help="Number of parallel warm up workers")
+    parser.add_argument("--sandbox-pool-size", type=int, default=SANDBOX_POOL_SIZE, help="Number of pre-built sandboxes kept ready for DML tasks")
+    parser.add_argument("--serve", action="store_true", help="Run on the multi-threaded waitress WSGI server, with debug off (production mode)")
+    parser.add_argument("--threads", type=int, default=SERVER_THREADS, help="Number of request threads in --serve mode")
+    parser.add_argument("--workers", type=int, default=QUERY_WORKERS, help="Number of query worker threads")
+    parser.add_argument("--live-channels", type=int, help=f"Live-preview channels open at once (default {LIVE_CHANNEL_LIMIT}, or 0 with --serve; at most --threads / 4 with --serve)")
+    parser.add_argument("--eval-processes", type=int, default=EVAL_PROCESSES, help="Number of evaluation worker processes (0 grades in the request threads)")
+    parser.add_argument("--progress-backend", choices=["memory", "sqlite", "kv"], default="sqlite", help="Where user progress is saved")
+    parser.add_argument("--progress-db", type=Path, default=PROGRESS_DB_PATH, help="SQLite file user progress is saved to (sqlite backend)")
+    parser.add_argument("--progress-shared", action="store_true", help="Reload progress other instances save to the --progress-db file (sqlite backend)")
+    parser.add_argument("--progress-kv-url", help="Base URL of the key-value store user progress is saved to (kv backend)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to serve on (run several instances on different ports to scale out)")
+    args = parser.parse_args()
+
+    if args.serve and waitress_serve is None:
+        print("--serve needs the waitress package (pip install waitress)")
+        sys.exit(1)
+
+    app_url = f"http://127.0.0.1:{args.port}/"
+    if check_if_running(app_url):
         print("App already running. Skipping initialization...")
-        webbrowser.open_new(APP_URL)
+        if not args.serve:
+            webbrowser.open_new(app_url)
         sys.exit(0)
     else:
         print("No existing instance found. Running full startup...")
@@ -1177,8 +3596,30 @@ if __name__ == "__main__":
         detect_and_validate_lessons()
         run_init_sql()
         load_database_tables()
+        PROGRESS_STORE.open(build_progress_backend(args.progress_backend, args.progress_db, args.progress_kv_url, args.progress_shared))
+        SANDBOX_POOL.size = args.sandbox_pool_size
+        SANDBOX_POOL.start()
+        if args.workers != QUERY_WORKERS:
+            QUERY_EXECUTOR.shutdown(wait=False)
+            QUERY_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="sql-query")
+            QUERY_SCHEDULER.slots = args.workers
+            READONLY_POOL.max_size = args.workers
+        if args.warm_up or args.strict_warm_up:
+            warm_up_expected_results(workers=args.warm_up_workers, strict=args.strict_warm_up)
+        if args.serve:
+            # Each channel holds one of waitress' fixed threads, so they are off unless asked for, and leave most threads free
+            LIVE_CHANNELS.limit = min(args.live_channels or 0, args.threads // 4)
+        elif args.live_channels is not None:
+            LIVE_CHANNELS.limit = args.live_channels
+        if args.eval_processes > 0:
+            EVAL_POOL.start(args.eval_processes)  # after the warm up, so the workers start with its expected results
         print("Loaded tables:", DATABASE_TABLES)
         print(f"Loaded {len(LESSON_LIST)} lessons")
         print(f"Loaded {len(TASKS_LIST)} tasks")
-        webbrowser.open_new(APP_URL)
-        app.run(host="0.0.0.0", port=8000, debug=True, use_reloader=False)
+        if args.serve:
+            # A served instance is usually headless, its users connect from their own machines
+            print(f"Serving on waitress with {args.threads} threads and {args.workers} query workers")
+            waitress_serve(app, host="0.0.0.0", port=args.port, threads=args.threads)
+        else:
+            webbrowser.open_new(app_url)
+            app.run(host="0.0.0.0", port=args.port, debug=True, use_reloader=False)
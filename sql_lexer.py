@@ -0,0 +1,114 @@
+"""
+Single-pass SQL tokenizer, used by app.py to validate and rewrite user queries.
+A query is tokenized once (results are cached), and everything the validation chain needs is read off that one token stream.
+"""
+import functools
+import hashlib
+import re
+
+LEX_CACHE_SIZE = 512  # distinct SQL strings whose lexing results are kept
+
+# Token types, in the order they are tried. Unterminated strings / comments run to the end of the input
+# (SQLite treats an unterminated block comment the same way, and rejects an unterminated string when the query is run).
+TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>[xX]?'(?:[^']|'')*'?)
+  | (?P<quoted>"(?:[^"]|"")*"?|`(?:[^`]|``)*`?|\[[^\]]*\]?)
+  | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<param>[?:@$][A-Za-z0-9_]*)
+  | (?P<operator>\|\||<<|>>|<=|>=|==|!=|<>|->>|->)
+  | (?P<symbol>.)
+""", re.VERBOSE | re.DOTALL)
+
+class LexedSQL:
+    """
+    The result of tokenizing an SQL string:
+        - text: the SQL with comments removed (each replaced by a space), and surrounding whitespace stripped
+        - statements: the comment free text of each non-empty statement, without its semicolon
+        - leading_keyword: the first keyword of the first statement (upper case), or None
+        - has_limit: whether the first statement has a top-level LIMIT (LIMITs inside brackets, e.g. subqueries, don't count)
+        - exact_fingerprint: a hash of the token stream, so queries differing only in comments or whitespace match
+          (words are kept as written: identifier case matters, e.g. for created table names and result column headers)
+    Keywords inside string literals, quoted identifiers and comments are never mistaken for SQL.
+    """
+
+    def __init__(self, text: str, statements: list, leading_keyword, has_limit: bool, exact_fingerprint: str):
+        self.text = text
+        self.statements = statements
+        self.leading_keyword = leading_keyword
+        self.has_limit = has_limit
+        self.exact_fingerprint = exact_fingerprint
+
+@functools.lru_cache(maxsize=LEX_CACHE_SIZE)
+def lex(sql: str) -> LexedSQL:
+    """
+    Tokenizes an SQL string in a single pass (see LexedSQL). The returned object is shared between callers and must not be modified.
+    """
+    text_parts = []
+    statement_parts = []
+    exact_tokens = []
+    statements = []
+    exact_statements = []
+
+    leading_keyword = None
+    first_token = True
+    has_limit = False
+    depth = 0
+
+    def end_statement():
+        statement = "".join(statement_parts).strip()
+        if statement:
+            statements.append(statement)
+            exact_statements.append(" ".join(exact_tokens))
+        statement_parts.clear()
+        exact_tokens.clear()
+
+    for match in TOKEN_RE.finditer(sql or ""):
+        kind = match.lastgroup
+        value = match.group()
+
+        if kind == "comment":
+            text_parts.append(" ")
+            statement_parts.append(" ")
+            continue
+
+        text_parts.append(value)
+        if kind == "space":
+            statement_parts.append(value)
+            continue
+
+        if value == ";":
+            end_statement()
+            depth = 0
+            continue
+
+        statement_parts.append(value)
+        exact_tokens.append(value)
+        in_first_statement = not statements
+
+        if kind == "word":
+            value = value.upper()
+            if first_token:
+                leading_keyword = value
+            if value == "LIMIT" and depth == 0 and in_first_statement:
+                has_limit = True
+        elif value == "(":
+            depth += 1
+        elif value == ")":
+            depth = max(depth - 1, 0)
+
+        first_token = False
+
+    end_statement()
+
+    exact_fingerprint = hashlib.blake2b(";".join(exact_statements).encode("utf-8"), digest_size=16).hexdigest()
+
+    return LexedSQL(
+        text="".join(text_parts).strip(),
+        statements=statements,
+        leading_keyword=leading_keyword,
+        has_limit=has_limit,
+        exact_fingerprint=exact_fingerprint
+    )
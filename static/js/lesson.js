@@ -4,9 +4,24 @@ let currentTaskNumber = null;
 let editor = null;
 let resultsTable = null;
 let debounceTimer = null;
+let previewTimer = null;
 let sqlContext = { tables: {} };
 let popupTimeout = null;
 let isUpdatingLessonMenu = false;
+// Previews are tagged with this editor's id and an increasing number, so the server can cancel a preview superseded by a newer one
+const editorId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+let previewSeq = 0;
+// A pause in typing only checks the query (compile only), it is previewed once typing stopped for PREVIEW_IDLE_DELAY
+const CHECK_DELAY = 400;
+const PREVIEW_IDLE_DELAY = 1500;
+let checkSeq = 0;
+let lastCheck = null;
+let lastPreviewSql = null;
+// Live-preview channel (Server-Sent Events), used instead of a POST per preview once it is open
+let liveChannel = null;
+let liveChannelReady = false;
+let liveChannelUnavailable = false;
+let liveResults = null;
 
 // ------------------------------------------------------------
 // INITIALISATION
@@ -402,7 +417,9 @@ function initMonaco() {
 
             editor.onDidChangeModelContent(() => {
                 clearTimeout(debounceTimer);
-                debounceTimer = setTimeout(runLiveQuery, 400);
+                clearTimeout(previewTimer);
+                debounceTimer = setTimeout(runLiveCheck, CHECK_DELAY);
+                previewTimer = setTimeout(runLiveQuery, PREVIEW_IDLE_DELAY);
             });
 
             // Register Ctrl+Enter shortcut
@@ -515,6 +532,21 @@ function scaleEditor(isLarge) {
     }
 }
 
+// Summarise the diff report of a wrong answer (full rows are logged to the console)
+function describeDiff(diff) {
+    if (diff.columns && diff.columns.expected.length !== diff.columns.actual.length) {
+        return `expected ${diff.columns.expected.length} columns, got ${diff.columns.actual.length}`;
+    }
+    if (diff["order-differs"]) {
+        return "the rows are in the wrong order";
+    }
+
+    const parts = [];
+    if (diff["missing-count"] > 0) parts.push(`${diff["missing-count"]} expected rows missing`);
+    if (diff["extra-count"] > 0) parts.push(`${diff["extra-count"]} unexpected rows`);
+    return parts.join(", ");
+}
+
 function showPopup(message, type = "error") {
     const popup = document.getElementById("sql-popup");
 
@@ -549,6 +581,109 @@ function showPopup(message, type = "error") {
 // ------------------------------------------------------------
 // LIVE SQL EXECUTION (NO SUBMISSION)
 // ------------------------------------------------------------
+function openLiveChannel() {
+    // Falls back to POST previews if the browser has no EventSource, the channel closes, or the server has none available
+    if (liveChannel || liveChannelUnavailable || !window.EventSource || !lesson) return;
+
+    liveChannel = new EventSource(`/lessons/live/${lesson["id"]}?editorId=${encodeURIComponent(editorId)}`);
+    const current = (event) => {
+        const data = JSON.parse(event.data);
+        return data.seq === previewSeq ? data : null;
+    };
+
+    liveChannel.addEventListener("ready", () => { liveChannelReady = true; });
+    liveChannel.addEventListener("columns", (event) => {
+        const data = current(event);
+        if (data) liveResults = { columns: data.columns, rows: [] };
+    });
+    liveChannel.addEventListener("rows", (event) => {
+        // Results are rendered progressively, batch by batch
+        const data = current(event);
+        if (!data || !liveResults) return;
+        liveResults.rows.push(...data.rows);
+        updateDataTable(liveResults);
+    });
+    liveChannel.addEventListener("done", (event) => {
+        if (current(event) && liveResults) updateDataTable(liveResults);
+    });
+    liveChannel.addEventListener("error", (event) => {
+        // Server sent error events have data, connection errors don't
+        if (event.data) {
+            const data = current(event);
+            if (data) showPopup(data.error, "error");
+            return;
+        }
+        closeLiveChannel();
+    });
+    liveChannel.addEventListener("idle", closeLiveChannel);
+    liveChannel.addEventListener("unavailable", () => {
+        // The server's channels are full or disabled, keep using POST previews for this page
+        liveChannelUnavailable = true;
+        closeLiveChannel();
+    });
+}
+
+function closeLiveChannel() {
+    if (liveChannel) liveChannel.close();
+    liveChannel = null;
+    liveChannelReady = false;
+}
+
+async function sendLiveQuery(sql, seq) {
+    // Returns true if the query was queued on the live-preview channel (its results arrive as events)
+    if (!liveChannelReady) {
+        openLiveChannel();
+        return false;
+    }
+    const response = await fetch(`/lessons/live/${lesson["id"]}/${lesson["exercise-tasks"][currentTaskNumber-1]["task-id"]}`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ query: sql, editorId: editorId, seq: seq })
+    });
+    if (response.status == 404) {
+        closeLiveChannel();
+        return false;
+    }
+    if (response.status == 400) {
+        const data = await response.json();
+        showPopup(data.error, "error");
+    }
+    return true;
+}
+
+async function checkQuery(sql) {
+    // Compile-only check (nothing is run): returns false, and shows the syntax error, if the query can't be previewed
+    const response = await fetch(`/lessons/check/${lesson["id"]}/${lesson["exercise-tasks"][currentTaskNumber-1]["task-id"]}`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ query: sql, editorId: editorId })
+    });
+    if (response.status != 200) {
+        // Shed or superseded (429 / 409), or an error the preview will report
+        return true;
+    }
+
+    const data = await response.json();
+    if (!data.valid) {
+        showPopup(data.message || data.error, "error");
+        return false;
+    }
+    return true;
+}
+
+async function runLiveCheck() {
+    // Runs on every pause in typing: reports syntax errors without previewing
+    if (!editor || !lesson || !currentTaskNumber) return;
+    if (!lesson["exercise-tasks"][currentTaskNumber-1]["preview-allowed"]) return;
+
+    const sql = editor.getValue();
+    if (!sql.trim()) return;
+
+    const seq = ++checkSeq;
+    const valid = await checkQuery(sql);
+    if (seq === checkSeq) lastCheck = { sql: sql, valid: valid };
+}
+
 async function runLiveQuery(initial_load=false) {
     if (!editor) return;
     
@@ -566,8 +701,12 @@ async function runLiveQuery(initial_load=false) {
         const response = await fetch(`/lessons/preview/${lesson["id"]}/${lesson["exercise-tasks"][currentTaskNumber-1]["task-id"]}`, {
             method: "POST",
             headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ query: preview_task["initial-query"] })
+            body: JSON.stringify({ query: preview_task["initial-query"], editorId: editorId, seq: ++previewSeq })
         });
+        if (response.status == 429 || response.status == 409) {
+            // Shed by the server (busy), or superseded by a newer preview
+            return;
+        }
          if (response.status == 400) {
             showPopup(data.error, "error");
             return;
@@ -587,18 +726,36 @@ async function runLiveQuery(initial_load=false) {
         updateDataTable(data.results);
     }
     
+    if (!initial_load && lesson && currentTaskNumber) {
+        // After typing stops, only queries that changed and passed their check are previewed
+        if (sql === lastPreviewSql) return;
+        if (lastCheck && lastCheck.sql === sql && !lastCheck.valid) return;
+    }
+    lastPreviewSql = sql;
+    const seq = ++previewSeq;
+    if (lesson && currentTaskNumber && await sendLiveQuery(sql, seq)) return;
+
     const response = await fetch(`/lessons/preview/${lesson["id"]}/${lesson["exercise-tasks"][currentTaskNumber-1]["task-id"]}`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ query: sql })
+        body: JSON.stringify({ query: sql, editorId: editorId, seq: seq })
     });
 
+    if (response.status == 429 || response.status == 409 || seq !== previewSeq) {
+        // Shed by the server (busy), or superseded by a newer preview
+        return;
+    }
+
     if (response.status == 400) {
         showPopup(data.error, "error");
         return;
     }
 
     const data = await response.json();
+    if (seq !== previewSeq) {
+        // A newer preview was sent while this one was being read
+        return;
+    }
 
     if (response.status == 400 && !data) {
         showPopup("Invalid SQL Query", "error");
@@ -642,6 +799,8 @@ async function submitSQL() {
     if (!result.resultsMatch) {
         if (result.userError != "") {
             showPopup(`Incorrect Answer: ${result.userError}`, "error");
+        } else if (result.diff) {
+            showPopup(`Incorrect Answer: ${describeDiff(result.diff)}`, "error");
         } else {
             showPopup(`Incorrect Answer`, "error");
         }
@@ -771,9 +930,9 @@ function updateDataTable(resultObj) {
         rows.forEach(row => {
             const tr = document.createElement("tr");
 
-            columns.forEach(col => {
+            columns.forEach((col, index) => {
                 const td = document.createElement("td");
-                td.textContent = row[col];
+                td.textContent = cellValue(row, col, index);
                 tr.appendChild(td);
             });
 
@@ -860,9 +1019,9 @@ function updateSourceTable(elementId, data) {
     rows.forEach(row => {
         const tr = document.createElement("tr");
 
-        columns.forEach(col => {
+        columns.forEach((col, index) => {
             const td = document.createElement("td");
-            td.textContent = row[col];
+            td.textContent = cellValue(row, col, index);
             tr.appendChild(td);
         });
 
@@ -873,6 +1032,11 @@ function updateSourceTable(elementId, data) {
     tableEl.appendChild(tableElem);
 }
 
+// Rows are arrays in column order (compact format), or objects keyed by column name
+function cellValue(row, col, index) {
+    return Array.isArray(row) ? row[index] : row[col];
+}
+
 function changeDataTableVisibility(set_visible) {
     const dataTable = document.getElementById("results-table-preview");
     if (!dataTable) return;
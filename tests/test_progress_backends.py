@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app import KVProgressBackend, LocalKVClient, ProgressStore, SessionState
+
+
+def test_kv_backend_round_trip():
+    client = LocalKVClient()
+    store = ProgressStore(KVProgressBackend(client), cache_ttl=0)
+    store.get("abc").complete_task(1.1)
+    store.flush()
+
+    assert client.get("sql-training-progress:abc") is not None
+    reloaded = ProgressStore(KVProgressBackend(client)).get("abc")
+    assert reloaded.completed() == (frozenset(), frozenset({1.1}))
+
+
+def test_kv_backend_merges_instances():
+    client = LocalKVClient()
+    first = ProgressStore(KVProgressBackend(client), cache_ttl=0)
+    second = ProgressStore(KVProgressBackend(client), cache_ttl=0)
+    first.get("abc").complete_task(1.1)
+    second.get("abc").complete_task(1.2)
+    first.flush()
+    second.flush()
+
+    assert KVProgressBackend(client).load("abc")["completed-tasks"] == [1.1, 1.2]
+    assert second.get("abc").completed()[1] == frozenset({1.1, 1.2})
+
+
+def test_kv_backend_keeps_later_reset():
+    client = LocalKVClient()
+    first = ProgressStore(KVProgressBackend(client), cache_ttl=0)
+    first.get("abc").complete_task(1.1)
+    first.flush()
+
+    second = ProgressStore(KVProgressBackend(client), cache_ttl=0)
+    second.get("abc").reset()
+    second.flush()
+
+    assert SessionState.from_dict(KVProgressBackend(client).load("abc")).is_empty()